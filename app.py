@@ -5,31 +5,52 @@ import logging
 import requests
 import time
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from litellm import completion
+from cache import SQLiteCache
+from contacted_index import ContactedIndex
+from prompts import PromptBuilder
+from profile_format import estimate_message_tokens
+from email_parser import parse_emails
+from rate_limit import get_limiter, call_with_retries
+from metrics import (
+    REGISTRY, APOLLO_SEARCH_SECONDS, APOLLO_MATCH_SECONDS, LLM_GENERATION_SECONDS, EMAIL_PARSE_SECONDS,
+    CSV_IO_SECONDS, ERRORS_TOTAL, RETRIES_TOTAL, record_cache_stats
+)
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO, 
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("app.log"),
-        logging.StreamHandler()
-    ]
-)
-
-# Parse command-line arguments
-parser = argparse.ArgumentParser(description='Process people data from Apollo API or CSV file')
-parser.add_argument('--input', type=str, help='Path to input CSV file')
-args = parser.parse_args()
-
 APOLLO_API_KEY = os.getenv("APOLLO_API_KEY")
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 DEEPSEEK_PROMPT = os.getenv("DEEPSEEK_PROMPT", "")
 CSV_FILENAME = os.getenv("CSV_FILENAME", "result.csv")
+APOLLO_BASE_URL = os.getenv("APOLLO_BASE_URL", "https://api.apollo.io/api/v1").rstrip("/")
+APOLLO_BATCH_SIZE = int(os.getenv("APOLLO_BATCH_SIZE", 10))  # Ids per people/bulk_match request (Apollo allows up to 10)
+APOLLO_TIMEOUT = float(os.getenv("APOLLO_TIMEOUT", 30))  # Read timeout per Apollo request, in seconds
+APOLLO_CONNECT_TIMEOUT = float(os.getenv("APOLLO_CONNECT_TIMEOUT", 10))
+
+# Process-wide rate limits and retry policy per upstream (shared by all --workers threads)
+APOLLO_RATE_LIMIT_PER_MINUTE = float(os.getenv("APOLLO_RATE_LIMIT_PER_MINUTE", 200))
+APOLLO_MAX_RETRIES = int(os.getenv("APOLLO_MAX_RETRIES", 3))
+LLM_RATE_LIMIT_PER_MINUTE = float(os.getenv("LLM_RATE_LIMIT_PER_MINUTE", 600))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+LLM_MODEL = os.getenv("LLM_MODEL", "deepseek/deepseek-chat")
+LLM_API_BASE = os.getenv("LLM_API_BASE") or None  # Override the provider endpoint (e.g. an OpenAI-compatible stub)
+apollo_limiter = get_limiter("apollo", APOLLO_RATE_LIMIT_PER_MINUTE)
+llm_limiter = get_limiter("llm", LLM_RATE_LIMIT_PER_MINUTE)
+
+# Persistent cache of Apollo person records, keyed by person id (shared with main.py)
+PERSON_CACHE_PATH = os.getenv("PERSON_CACHE_PATH", "apollo_cache.sqlite3")
+PERSON_CACHE_TTL = int(os.getenv("PERSON_CACHE_TTL", 7 * 24 * 3600))  # Seconds
+PERSON_CACHE_MAX_ENTRIES = int(os.getenv("PERSON_CACHE_MAX_ENTRIES", 50000))
+person_cache = SQLiteCache(PERSON_CACHE_PATH, table="apollo_people", ttl=PERSON_CACHE_TTL, max_entries=PERSON_CACHE_MAX_ENTRIES)
+
+# Prospects that already got generated emails, by Apollo id and email; skipped unless --include-contacted
+CONTACTED_INDEX_PATH = os.getenv("CONTACTED_INDEX_PATH", "contacted.sqlite3")
+contacted_index = ContactedIndex(CONTACTED_INDEX_PATH)
+
+CSV_FLUSH_EVERY = int(os.getenv("CSV_FLUSH_EVERY", 20))  # Output rows buffered between flushes
 
 if not CSV_FILENAME.strip():  # Check if empty or contains only whitespace
     CSV_FILENAME = "result.csv"
@@ -41,6 +62,44 @@ HEADERS = {
     "X-Api-Key": APOLLO_API_KEY
 }
 
+# Static prompt prefix sent as a separate system message so providers can cache it
+EMAIL_OUTPUT_INSTRUCTIONS = (
+    "The result should only be in JSON format:\n"
+    "[\n"
+    "    {\n"
+    "        \"subject\": \"Hey John, Special Offer!\",\n"
+    "        \"body\": \"Hey John, we have an exclusive discount for Acme Corp!\"\n"
+    "    },\n"
+    "    {\n"
+    "        \"subject\": \"Following up on my last email\",\n"
+    "        \"body\": \"Hey John, just checking if you saw my last email about the Acme Corp discount!\"\n"
+    "    }\n"
+    "]"
+)
+PROFILE_TOKEN_BUDGET = int(os.getenv("PROFILE_TOKEN_BUDGET", 400))  # Estimated tokens per serialized profile (0 = no limit)
+prompt_builder = PromptBuilder(DEEPSEEK_PROMPT, output_instructions=EMAIL_OUTPUT_INSTRUCTIONS, profile_token_budget=PROFILE_TOKEN_BUDGET)
+
+def completion(*args, **kwargs):
+    # litellm takes seconds to import; only runs that generate emails pay for it
+    from litellm import completion as litellm_completion
+    return litellm_completion(*args, **kwargs)
+
+def log_retry(upstream, metric_label):
+    def on_retry(attempt, response, exc):
+        RETRIES_TOTAL.inc(upstream=metric_label)
+        reason = f"status {response.status_code}" if response is not None else str(exc)
+        logging.warning(f"{upstream} request failed ({reason}); retry {attempt + 1}")
+    return on_retry
+
+def apollo_post(url, **kwargs):
+    """POST to Apollo through the shared rate limiter and retry policy."""
+    return call_with_retries(
+        lambda: requests.post(url, headers=HEADERS, timeout=(APOLLO_CONNECT_TIMEOUT, APOLLO_TIMEOUT), **kwargs),
+        limiter=apollo_limiter,
+        max_retries=APOLLO_MAX_RETRIES,
+        on_retry=log_retry("Apollo", "apollo")
+    )
+
 def update_csv_filename():
     logging.info(f"Setting up CSV file: {CSV_FILENAME}")
     if not os.path.exists(CSV_FILENAME):
@@ -57,25 +116,71 @@ def update_csv_filename():
             return new_filename
         counter += 1
 
-CSV_FILENAME = update_csv_filename()
+def fetch_person_data(people_id, refresh=False):
+    if not refresh:
+        cached = person_cache.get(people_id)
+        if cached is not None:
+            logging.debug(f"Using cached person data for {people_id}")
+            return {"person": cached}
 
-def fetch_person_data(people_id):
-    url = f"https://api.apollo.io/api/v1/people/match?id={people_id}"
+    url = f"{APOLLO_BASE_URL}/people/match?id={people_id}"
     try:
-        start_time = time.time()
-        response = requests.post(url, headers=HEADERS)
-        elapsed_time = time.time() - start_time
+        with APOLLO_MATCH_SECONDS.time(endpoint="match"):
+            response = apollo_post(url)
         
         if response.status_code == 200:
-            return response.json()
+            data = response.json()
+            if data.get("person"):
+                person_cache.set(people_id, data["person"])
+            return data
         else:
+            ERRORS_TOTAL.inc(stage="apollo_match")
             logging.error(f"Failed to fetch person data for {people_id}: Status {response.status_code}")
             logging.error(f"Response: {response.text[:200]}...")
             return None
     except Exception as e:
+        ERRORS_TOTAL.inc(stage="apollo_match")
         logging.error(f"Exception while fetching person data for {people_id}: {str(e)}")
         return None
 
+def fetch_people_data_bulk(people_ids):
+    """Fetch a batch of people with Apollo bulk match.
+
+    Returns {people_id: {"person": ...} or None} in the same shape as
+    fetch_person_data. Ids missing from the bulk response, or the whole
+    batch if the request fails, fall back to single lookups. Matches are
+    written to the person cache; cached ids should be served by the caller.
+    """
+    results = {}
+    try:
+        with APOLLO_MATCH_SECONDS.time(endpoint="bulk_match"):
+            response = apollo_post(
+                f"{APOLLO_BASE_URL}/people/bulk_match",
+                json={"details": [{"id": people_id} for people_id in people_ids]}
+            )
+        if response.status_code == 200:
+            for position, person in enumerate(response.json().get("matches") or []):
+                if not person:
+                    continue
+                people_id = person.get("id") or (people_ids[position] if position < len(people_ids) else None)
+                if people_id in people_ids:
+                    person_cache.set(people_id, person)
+                    results[people_id] = {"person": person}
+        else:
+            ERRORS_TOTAL.inc(stage="apollo_match")
+            logging.error(f"Bulk match failed: Status {response.status_code}")
+            logging.error(f"Response: {response.text[:200]}...")
+    except Exception as e:
+        ERRORS_TOTAL.inc(stage="apollo_match")
+        logging.error(f"Exception during bulk match: {str(e)}")
+
+    missing = [people_id for people_id in people_ids if people_id not in results]
+    if missing:
+        logging.info(f"Falling back to single lookups for {len(missing)} of {len(people_ids)} people")
+    for people_id in missing:
+        results[people_id] = fetch_person_data(people_id, refresh=True)
+    return results
+
 def filter_person_data(data):
     person = data.get("person", {})
     organization = person.get("organization", {})
@@ -103,63 +208,48 @@ def filter_person_data(data):
     return filtered_data
 
 def generate_email_content(profile_data):
-    person_name = f"{profile_data['person']['first_name']} {profile_data['person']['last_name']}"
-    
-    content = (
-        f"Here is the profile data: {profile_data}. The result should only be in JSON format:\n"
-        "[\n"
-        "    {\n"
-        "        \"subject\": \"Hey John, Special Offer!\",\n"
-        "        \"body\": \"Hey John, we have an exclusive discount for Acme Corp!\"\n"
-        "    },\n"
-        "    {\n"
-        "        \"subject\": \"Following up on my last email\",\n"
-        "        \"body\": \"Hey John, just checking if you saw my last email about the Acme Corp discount!\"\n"
-        "    }\n"
-        "]"
-    )
+    messages = prompt_builder.build_messages(profile_data)
+    logging.info(f"Prompt size: ~{estimate_message_tokens(messages)} tokens")
     
     try:
-        start_time = time.time()
-        response = completion(
-            model="deepseek/deepseek-chat", 
-            messages=[{"role": "user", "content": DEEPSEEK_PROMPT + content}]
-        )
-        elapsed_time = time.time() - start_time
+        with LLM_GENERATION_SECONDS.time(mode="single"):
+            response = call_with_retries(
+                lambda: completion(
+                    model=LLM_MODEL,
+                    messages=messages,
+                    api_base=LLM_API_BASE
+                ),
+                limiter=llm_limiter,
+                max_retries=LLM_MAX_RETRIES,
+                on_retry=log_retry("DeepSeek", "llm")
+            )
         return response
     except Exception as e:
+        ERRORS_TOTAL.inc(stage="llm")
         logging.error(f"Error generating email content: {str(e)}")
         return {"choices": [{"message": {"content": "[]"}}]}
 
 def extract_email_content(deepseek_response):
     try:
-        content_text = deepseek_response["choices"][0]["message"]["content"]
-        
-        # Try to find JSON content between ```json and ``` markers
-        if "```json" in content_text:
-            json_content = content_text.split("```json")[-1].split("```")[0].strip()
-        # If not found, try to extract just the JSON part
-        else:
-            # Find first [ and last ]
-            start_idx = content_text.find("[")
-            end_idx = content_text.rfind("]") + 1
-            if start_idx >= 0 and end_idx > start_idx:
-                json_content = content_text[start_idx:end_idx]
-            else:
-                json_content = content_text
-        
-        parsed_content = json.loads(json_content)
-        return parsed_content
-    except Exception as e:
+        content_text = deepseek_response["choices"][0]["message"]["content"] or ""
+    except (KeyError, IndexError, TypeError) as e:
         logging.error(f"Error extracting email data: {e}")
-        logging.error(f"Raw content: {deepseek_response.get('choices', [{}])[0].get('message', {}).get('content', '')[:200]}...")
         return []
+    with EMAIL_PARSE_SECONDS.time():
+        email_data = parse_emails(content_text)
+    if not email_data:
+        ERRORS_TOTAL.inc(stage="parse")
+        logging.error(f"Raw content: {content_text[:200]}...")
+    return email_data
 
-def save_to_csv(data, filename=CSV_FILENAME):
-    person_name = f"{data['person']['first_name']} {data['person']['last_name']}"
-    logging.info(f"Saving data for {person_name} to CSV: {filename}")
-    
-    row = {
+PEOPLE_CSV_COLUMNS = [
+    "EMAIL", "Website", "First Name", "Last Name", "Title", "Company",
+    "Mail Subject", "Main Email", "Second Subject", "Second Email"
+]
+
+def person_csv_row(data):
+    """Map filtered person data with generated emails to an output CSV row."""
+    return {
         "EMAIL": data["person"]["email"],
         "Website": data["organization"]["website"],
         "First Name": data["person"]["first_name"],
@@ -171,25 +261,90 @@ def save_to_csv(data, filename=CSV_FILENAME):
         "Second Subject": data.get("followup_email_subject", ""),
         "Second Email": data.get("followup_email_content", "")
     }
-    
-    try:
-        file_exists = os.path.isfile(filename)
-        with open(filename, "a", newline="", encoding="utf-8") as file:
-            writer = csv.DictWriter(file, fieldnames=row.keys(), quoting=csv.QUOTE_ALL)
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(row)
-    except Exception as e:
-        logging.error(f"Error saving to CSV: {str(e)}")
 
-def process_people_data(people_id, current_index, total_count):
+class CsvSink:
+    """Single writer for CLI output.
+
+    Keeps one buffered file handle and one DictWriter open for the whole
+    run and flushes every `flush_every` rows. Rows are passed with their
+    sequence number; with `preserve_order` they are written in sequence
+    order no matter which worker finishes first (a None row just advances
+    the sequence). When a checkpoint file is given, the keys of written
+    rows are appended to it after each flush of the output.
+    """
+
+    def __init__(self, path, fieldnames, append=False, preserve_order=False, flush_every=CSV_FLUSH_EVERY, checkpoint=None):
+        write_header = not append or not os.path.isfile(path) or os.path.getsize(path) == 0
+        self.path = path
+        self.file = open(path, "a" if append else "w", newline="", encoding="utf-8", buffering=1024 * 1024)
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames, quoting=csv.QUOTE_ALL, extrasaction="ignore")
+        if write_header:
+            self.writer.writeheader()
+        self.preserve_order = preserve_order
+        self.flush_every = max(1, flush_every)
+        self.checkpoint = checkpoint
+        self.next_seq = 0
+        self.pending = {}
+        self.unflushed = 0
+        self.checkpoint_keys = []
+        self.written = 0
+
+    def write(self, seq, row, checkpoint_key=None):
+        if not self.preserve_order:
+            self._emit(row, checkpoint_key)
+            return
+        self.pending[seq] = (row, checkpoint_key)
+        while self.next_seq in self.pending:
+            self._emit(*self.pending.pop(self.next_seq))
+            self.next_seq += 1
+
+    def _emit(self, row, checkpoint_key):
+        if row is None:
+            return
+        with CSV_IO_SECONDS.time(op="write"):
+            self.writer.writerow(row)
+        self.written += 1
+        self.unflushed += 1
+        if checkpoint_key is not None:
+            self.checkpoint_keys.append(checkpoint_key)
+        if self.unflushed >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        with CSV_IO_SECONDS.time(op="flush"):
+            self.file.flush()
+            if self.checkpoint and self.checkpoint_keys:
+                self.checkpoint.write("".join(f"{key}\n" for key in self.checkpoint_keys))
+                self.checkpoint.flush()
+        self.checkpoint_keys = []
+        self.unflushed = 0
+
+    def close(self):
+        # Anything still waiting on a missing sequence number is written as is
+        for seq in sorted(self.pending):
+            self._emit(*self.pending.pop(seq))
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def process_people_data(people_id, current_index, total_count, person_data=None, skip_contacted=False):
+    """Enrich (if needed) and generate emails for one person; returns the output CSV row or None."""
     logging.info(f"Processing person {current_index}/{total_count} (ID: {people_id})")
     
-    # Fetch person data
-    person_data = fetch_person_data(people_id)
+    # Fetch person data unless it was already enriched in bulk
+    if person_data is None:
+        person_data = fetch_person_data(people_id)
     if not person_data:
         logging.warning(f"Skipping person {current_index}/{total_count} - could not fetch data")
-        return
+        return None
+    if skip_contacted and contacted_index.contains(email=person_data.get("person", {}).get("email")):
+        logging.info(f"Skipping person {current_index}/{total_count} - already contacted")
+        return None
     
     # Extract and filter data
     filtered_data = filter_person_data(person_data)
@@ -215,16 +370,52 @@ def process_people_data(people_id, current_index, total_count):
         })
     else:
         logging.error("Failed to generate any email content")
+    if email_data:
+        contacted_index.add(people_id, filtered_data["person"].get("email"))
     
-    # Save data to CSV
-    save_to_csv(filtered_data)
-    
-    # Log progress
-    progress_percentage = (current_index / total_count) * 100
-    logging.info(f"Progress: {progress_percentage:.1f}% complete ({current_index}/{total_count})")
+    return person_csv_row(filtered_data)
 
-def search_people():
+def iter_search_pages(payload, max_results=0):
+    """Yield (page, response, new people ids) for consecutive Apollo search pages.
+
+    With max_results 0 only payload["page"] is fetched. Otherwise the next
+    page is requested in a background thread while the caller processes the
+    current one, until max_results unique people were yielded or the
+    reported page count is reached.
+    """
+    url = f"{APOLLO_BASE_URL}/mixed_people/search"
+    page = payload.get("page", 1)
+    seen = set()
+    def fetch_page(page_number):
+        with APOLLO_SEARCH_SECONDS.time():
+            return apollo_post(url, json={**payload, "page": page_number})
+
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        next_fetch = prefetcher.submit(fetch_page, page)
+        while next_fetch is not None:
+            response = next_fetch.result()
+            next_fetch = None
+            if response.status_code != 200:
+                ERRORS_TOTAL.inc(stage="apollo_search")
+                yield page, response, []
+                return
+
+            data = response.json()
+            people_ids = []
+            for person in data.get("people", []):
+                if person["id"] not in seen and (not max_results or len(seen) < max_results):
+                    seen.add(person["id"])
+                    people_ids.append(person["id"])
+
+            total_pages = (data.get("pagination") or {}).get("total_pages") or page
+            if max_results and len(seen) < max_results and page < total_pages and data.get("people"):
+                next_fetch = prefetcher.submit(fetch_page, page + 1)
+            yield page, response, people_ids
+            page += 1
+
+def search_people(refresh_cache=False, workers=1, preserve_order=False, max_results=0, skip_contacted=True, output_path=None):
     logging.info("Starting people search with Apollo API")
+    output_path = output_path or update_csv_filename()
     
     # Build search payload from environment variables
     payload = {k: v for k, v in {
@@ -246,28 +437,164 @@ def search_people():
     
     try:
         start_time = time.time()
-        response = requests.post("https://api.apollo.io/api/v1/mixed_people/search", headers=HEADERS, json=payload)
-        elapsed_time = time.time() - start_time
-        
-        if response.status_code == 200:
-            data = response.json()
-            total_people = len(data.get("people", []))
-            logging.info(f"Successfully retrieved {total_people} people from Apollo API in {elapsed_time:.2f}s")
-            
-            # Extract people IDs
-            people_ids = [person["id"] for person in data.get("people", [])]
-            
-            # Process each person
-            for idx, people_id in enumerate(people_ids, 1):
-                process_people_data(people_id, idx, total_people)
-                
-        else:
-            logging.error(f"Failed to search people: Status {response.status_code}")
-            logging.error(f"Response: {response.text[:500]}...")
+        processed = 0
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool, \
+                CsvSink(output_path, PEOPLE_CSV_COLUMNS, append=True, preserve_order=preserve_order) as sink:
+            for page, response, people_ids in iter_search_pages(payload, max_results):
+                elapsed_time = time.time() - start_time
+                if response.status_code != 200:
+                    logging.error(f"Failed to search people (page {page}): Status {response.status_code}")
+                    logging.error(f"Response: {response.text[:500]}...")
+                    break
+
+                logging.info(f"Successfully retrieved {len(people_ids)} people from Apollo API page {page} after {elapsed_time:.2f}s")
+
+                # Known prospects are dropped before any Apollo or DeepSeek call
+                if skip_contacted:
+                    fresh_ids = [people_id for people_id in people_ids if not contacted_index.contains(person_id=people_id)]
+                    if len(fresh_ids) < len(people_ids):
+                        logging.info(f"Skipping {len(people_ids) - len(fresh_ids)} already contacted people")
+                    people_ids = fresh_ids
+                total_people = len(people_ids)
+
+                # Serve cached people first, then enrich the rest in bulk-match batches
+                people_data = {}
+                if not refresh_cache:
+                    for people_id in people_ids:
+                        cached = person_cache.get(people_id)
+                        if cached is not None:
+                            people_data[people_id] = {"person": cached}
+                    logging.info(f"Person cache: {len(people_data)}/{total_people} people served from cache")
+                uncached_ids = [people_id for people_id in people_ids if people_id not in people_data]
+                batches = [uncached_ids[start:start + APOLLO_BATCH_SIZE] for start in range(0, len(uncached_ids), APOLLO_BATCH_SIZE)]
+
+                for batch_data in pool.map(fetch_people_data_bulk, batches):
+                    people_data.update(batch_data)
+
+                futures = {}
+                for idx, people_id in enumerate(people_ids, 1):
+                    # People that could not be fetched are skipped by process_people_data
+                    person_data = people_data.get(people_id) or {}
+                    futures[pool.submit(process_people_data, people_id, idx, total_people, person_data, skip_contacted)] = processed + idx - 1
+
+                # Only this thread writes, so the sink needs no locking
+                try:
+                    for done, future in enumerate(as_completed(futures), 1):
+                        sink.write(futures[future], future.result())
+                        progress_percentage = (done / total_people) * 100
+                        logging.info(f"Progress (page {page}): {progress_percentage:.1f}% complete ({done}/{total_people})")
+                except BaseException:
+                    pool.shutdown(wait=False, cancel_futures=True)  # Don't wait for queued people on failure
+                    raise
+                processed += total_people
+
+        logging.info(f"Saved {sink.written} people to CSV: {output_path}")
+
+        stats = person_cache.stats()
+        logging.info(f"Person cache stats: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
     except Exception as e:
         logging.error(f"Exception during people search: {str(e)}")
 
-def process_csv_file(csv_path):
+def checkpoint_path_for(output_path):
+    return f"{output_path}.checkpoint"
+
+def find_existing_output(csv_path):
+    """Return the most recently numbered *_with_email.csv output for csv_path, or None."""
+    base = f"{os.path.splitext(os.path.basename(csv_path))[0]}_with_email"
+    latest = f"{base}.csv" if os.path.exists(f"{base}.csv") else None
+    counter = 1
+    while os.path.exists(f"{base}_{counter}.csv"):
+        latest = f"{base}_{counter}.csv"
+        counter += 1
+    return latest
+
+def load_completed_rows(csv_path, output_path):
+    """Return (row indices, emails) already completed in output_path.
+
+    The sidecar checkpoint lists finished input row indices, so resuming
+    does not need to re-read the output. Without a usable checkpoint the
+    existing output is scanned and rows are matched by email instead.
+    """
+    checkpoint_path = checkpoint_path_for(output_path)
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            header = json.loads(f.readline() or "{}")
+            if header.get("input") == os.path.abspath(csv_path):
+                return {int(line) for line in f if line.strip().isdigit()}, set()
+        logging.warning(f"Checkpoint {checkpoint_path} belongs to a different input; matching rows by email")
+
+    emails = set()
+    if os.path.exists(output_path):
+        with open(output_path, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                email = (row.get("Email") or "").strip().lower()
+                if email:
+                    emails.add(email)
+    return set(), emails
+
+def add_email_columns(row, email_data, idx):
+    """Fill the generated email columns of a CSV row from extracted email data."""
+    if len(email_data) >= 2:
+        row.update({
+            "Mail Subject": email_data[0]["subject"].replace("’", "'"),
+            "Main Email": email_data[0]["body"].replace("’", "'"),
+            "Second Subject": email_data[1]["subject"].replace("’", "'"),
+            "Second Email": email_data[1]["body"].replace("’", "'")
+        })
+    elif len(email_data) == 1:
+        row.update({
+            "Mail Subject": email_data[0]["subject"].replace("’", "'"),
+            "Main Email": email_data[0]["body"].replace("’", "'"),
+            "Second Subject": "",
+            "Second Email": ""
+        })
+    else:
+        logging.error(f"Failed to generate any email content for row {idx}")
+        row.update({
+            "Mail Subject": "",
+            "Main Email": "",
+            "Second Subject": "",
+            "Second Email": ""
+        })
+    return row
+
+def process_csv_row(row, idx):
+    """Generate emails for one input CSV row and return the updated row."""
+    logging.info(f"Processing row {idx}: {row.get('First Name', '')} {row.get('Last Name', '')}")
+    
+    # Prepare data for Deepseek in the same format as we use for Apollo data
+    profile_data = {
+        "person": {
+            "first_name": row.get("First Name", ""),
+            "last_name": row.get("Last Name", ""),
+            "title": row.get("Title", ""),
+            "email": row.get("Email", ""),
+            "headline": ""
+        },
+        "organization": {
+            "name": row.get("Company", ""),
+            "city": row.get("Company City", ""),
+            "technology_names": row.get("Technologies", "").split(", ") if row.get("Technologies") else [],
+            "industries": [row.get("Industry", "")] if row.get("Industry") else [],
+            "keywords": row.get("Keywords", "").split(", ") if row.get("Keywords") else [],
+            "estimated_num_employees": row.get("# Employees", ""),
+            "website": row.get("Website", "")
+        }
+    }
+    
+    # Generate email content
+    deepseek_response = generate_email_content(profile_data)
+    
+    # Extract email data
+    email_data = extract_email_content(deepseek_response)
+    
+    if email_data:
+        contacted_index.add(email=row.get("Email"))
+    
+    # Update row with email content
+    return add_email_columns(row, email_data, idx)
+
+def process_csv_file(csv_path, output_path=None, resume=False, workers=1, preserve_order=False, skip_contacted=True):
     """Process data from an input CSV file."""
     logging.info(f"Starting CSV file processing mode with file: {csv_path}")
     
@@ -277,25 +604,36 @@ def process_csv_file(csv_path):
     
     try:
         # Read the input CSV file
-        with open(csv_path, 'r', encoding='utf-8') as f:
+        with open(csv_path, 'r', encoding='utf-8') as f, CSV_IO_SECONDS.time(op="read"):
             reader = csv.DictReader(f)
             rows = list(reader)
         
         total_rows = len(rows)
         
-        # Create output CSV filename
-        output_path = f"{os.path.splitext(os.path.basename(csv_path))[0]}_with_email.csv"        
-        if os.path.exists(output_path):
-            base, ext = os.path.splitext(output_path)
-            counter = 1
-            while os.path.exists(f"{base}_{counter}{ext}"):
-                counter += 1
-            output_path = f"{base}_{counter}{ext}"
+        # Create output CSV filename, reusing the last output when resuming
+        if resume and not output_path:
+            output_path = find_existing_output(csv_path)
+        if not output_path:
+            output_path = f"{os.path.splitext(os.path.basename(csv_path))[0]}_with_email.csv"        
+            if os.path.exists(output_path):
+                base, ext = os.path.splitext(output_path)
+                counter = 1
+                while os.path.exists(f"{base}_{counter}{ext}"):
+                    counter += 1
+                output_path = f"{base}_{counter}{ext}"
+        
+        completed_indices, completed_emails = set(), set()
+        resuming = resume and os.path.exists(output_path)
+        if resuming:
+            completed_indices, completed_emails = load_completed_rows(csv_path, output_path)
+            logging.info(f"Resuming {output_path}: {len(completed_indices) or len(completed_emails)} rows already completed")
         
         logging.info(f"Output will be saved to: {output_path}")
         
-        # Open output CSV file
-        with open(output_path, 'w', newline='', encoding='utf-8') as f_out:
+        # Open the checkpoint sidecar; the output itself is owned by a single CsvSink writer
+        checkpoint_path = checkpoint_path_for(output_path)
+        checkpoint_exists = resuming and os.path.exists(checkpoint_path) and bool(completed_indices)
+        with open(checkpoint_path, 'a' if checkpoint_exists else 'w', encoding='utf-8') as f_checkpoint:
             # Get all field names from the input CSV plus our new email fields
             fieldnames = list(rows[0].keys()) + [
                 "Mail Subject", 
@@ -304,76 +642,82 @@ def process_csv_file(csv_path):
                 "Second Email"
             ]
             
-            writer = csv.DictWriter(f_out, fieldnames=fieldnames, quoting=csv.QUOTE_ALL)
-            writer.writeheader()
+            if not checkpoint_exists:
+                f_checkpoint.write(json.dumps({"input": os.path.abspath(csv_path)}) + "\n")
+                # Rows recovered by email are recorded so the next resume can use the checkpoint alone
+                for idx, row in enumerate(rows, 1):
+                    if (row.get("Email") or "").strip().lower() in completed_emails:
+                        completed_indices.add(idx)
+                        f_checkpoint.write(f"{idx}\n")
+                f_checkpoint.flush()
             
-            # Process each row
-            for idx, row in enumerate(rows, 1):
-                logging.info(f"Processing row {idx}/{total_rows}: {row.get('First Name', '')} {row.get('Last Name', '')}")
-                
-                # Prepare data for Deepseek in the same format as we use for Apollo data
-                profile_data = {
-                    "person": {
-                        "first_name": row.get("First Name", ""),
-                        "last_name": row.get("Last Name", ""),
-                        "title": row.get("Title", ""),
-                        "email": row.get("Email", ""),
-                        "headline": ""
-                    },
-                    "organization": {
-                        "name": row.get("Company", ""),
-                        "city": row.get("Company City", ""),
-                        "technology_names": row.get("Technologies", "").split(", ") if row.get("Technologies") else [],
-                        "industries": [row.get("Industry", "")] if row.get("Industry") else [],
-                        "keywords": row.get("Keywords", "").split(", ") if row.get("Keywords") else [],
-                        "estimated_num_employees": row.get("# Employees", ""),
-                        "website": row.get("Website", "")
-                    }
-                }
-                
-                # Generate email content
-                deepseek_response = generate_email_content(profile_data)
-                
-                # Extract email data
-                email_data = extract_email_content(deepseek_response)
-                
-                # Update row with email content
-                if len(email_data) >= 2:
-                    row.update({
-                        "Mail Subject": email_data[0]["subject"].replace("’", "'"),
-                        "Main Email": email_data[0]["body"].replace("’", "'"),
-                        "Second Subject": email_data[1]["subject"].replace("’", "'"),
-                        "Second Email": email_data[1]["body"].replace("’", "'")
-                    })
-                elif len(email_data) == 1:
-                    row.update({
-                        "Mail Subject": email_data[0]["subject"].replace("’", "'"),
-                        "Main Email": email_data[0]["body"].replace("’", "'"),
-                        "Second Subject": "",
-                        "Second Email": ""
-                    })
-                else:
-                    logging.error(f"Failed to generate any email content for row {idx}")
-                    row.update({
-                        "Mail Subject": "",
-                        "Main Email": "",
-                        "Second Subject": "",
-                        "Second Email": ""
-                    })
-                
-                # Write the updated row to the output CSV
-                writer.writerow(row)
+            remaining = [(idx, row) for idx, row in enumerate(rows, 1) if idx not in completed_indices]
+            skipped = 0
+            # A resumed run may hold rows generated before the crash but never flushed; keep them
+            if skip_contacted and not resuming:
+                fresh = [(idx, row) for idx, row in remaining if not contacted_index.contains(email=row.get("Email"))]
+                skipped = len(remaining) - len(fresh)
+                remaining = fresh
+                if skipped:
+                    logging.info(f"Skipping {skipped} already contacted rows")
+            
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool, \
+                    CsvSink(output_path, fieldnames, append=resuming, preserve_order=preserve_order, checkpoint=f_checkpoint) as sink:
+                futures = {pool.submit(process_csv_row, row, idx): (seq, idx) for seq, (idx, row) in enumerate(remaining)}
                 
-                # Log progress
-                progress_percentage = (idx / total_rows) * 100
-                logging.info(f"Progress: {progress_percentage:.1f}% complete ({idx}/{total_rows})")
+                # Only this thread writes; rows reach the checkpoint once they are flushed to the output
+                try:
+                    for done, future in enumerate(as_completed(futures), 1):
+                        seq, idx = futures[future]
+                        sink.write(seq, future.result(), checkpoint_key=idx)
+                        
+                        # Log progress
+                        completed = len(completed_indices) + skipped + done
+                        progress_percentage = (completed / total_rows) * 100
+                        logging.info(f"Progress: {progress_percentage:.1f}% complete ({completed}/{total_rows})")
+                except BaseException:
+                    pool.shutdown(wait=False, cancel_futures=True)  # Don't wait for queued rows on failure
+                    raise
                 
         logging.info(f"CSV processing completed. Output saved to: {output_path}")
         
     except Exception as e:
         logging.error(f"Error processing CSV file: {str(e)}")
 
-if __name__ == "__main__":
+def log_metrics_summary():
+    """Log per-stage latencies and error/retry/cache counts for this run."""
+    record_cache_stats("person", person_cache)
+    lines = REGISTRY.summary_lines()
+    logging.info("=== Metrics summary ===" if lines else "=== Metrics summary: nothing recorded ===")
+    for line in lines:
+        logging.info(f"  {line}")
+
+def configure_logging():
+    logging.basicConfig(
+        level=logging.INFO, 
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("app.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Process people data from Apollo API or CSV file')
+    parser.add_argument('--input', type=str, help='Path to input CSV file')
+    parser.add_argument('--refresh-cache', action='store_true', help='Bypass cached Apollo person data and fetch it fresh')
+    parser.add_argument('--output', type=str, help='Path to the output CSV file (default: <input>_with_email.csv in CSV mode, a new CSV_FILENAME in search mode)')
+    parser.add_argument('--resume', action='store_true', help='Continue an interrupted CSV run, skipping rows already in the output')
+    parser.add_argument('--workers', type=int, default=1, help='Number of people/rows enriched and generated in parallel')
+    parser.add_argument('--preserve-order', action='store_true', help='Write output rows in input order even when running with several workers')
+    parser.add_argument('--include-contacted', action='store_true', help='Also process prospects that already got generated emails in an earlier run')
+    parser.add_argument('--max-results', type=int, default=int(os.getenv("MAX_RESULTS", 0)), help='Walk search pages from PAGE until this many people are processed (0 = only one page)')
+    return parser
+
+def main(argv=None):
+    """Command-line entry point; importing this module has no side effects beyond reading .env."""
+    args = build_parser().parse_args(argv)
+    configure_logging()
     start_time = time.time()
     logging.info("=== Script execution started ===")
     
@@ -381,13 +725,18 @@ if __name__ == "__main__":
         # Determine which mode to run in
         if args.input:
             # CSV input mode
-            process_csv_file(args.input)
+            process_csv_file(args.input, output_path=args.output, resume=args.resume, workers=args.workers, preserve_order=args.preserve_order, skip_contacted=not args.include_contacted)
         else:
             # Apollo API mode
-            search_people()
+            search_people(refresh_cache=args.refresh_cache, workers=args.workers, preserve_order=args.preserve_order, max_results=args.max_results, skip_contacted=not args.include_contacted, output_path=args.output)
             
         elapsed_time = time.time() - start_time
         logging.info(f"=== Script completed successfully in {elapsed_time:.2f} seconds ===")
     except Exception as e:
         elapsed_time = time.time() - start_time
-        logging.error(f"=== Script failed after {elapsed_time:.2f} seconds: {str(e)} ===")
\ No newline at end of file
+        logging.error(f"=== Script failed after {elapsed_time:.2f} seconds: {str(e)} ===")
+    finally:
+        log_metrics_summary()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+"""Benchmark the web app and the CLI against local Apollo and LLM stubs.
+
+    python bench/run.py --sizes 10,100 --concurrency 1,5 --output bench.json
+
+Starts the stubs from stubs.py, runs main.py under uvicorn (and app.py
+as a subprocess) with every upstream, cache and store pointed at a
+temporary directory, then drives each scenario at every size and
+concurrency level. Results are printed (or written to --output) as JSON:
+throughput, p50/p95/p99 latency and peak RSS per combination.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+from stubs import StubConfig, start_apollo_stub, start_chat_stub
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("peoples", "process-csv", "export-csv", "cli-csv", "cli-search")
+# Scenarios that report one event per finished prospect/row; the others count `size` items per request
+STREAMED_SCENARIOS = ("peoples", "process-csv")
+USERNAME, PASSWORD = "admin@gmail.com", "Abc@12345"  # FAKE_USERS_DB in main.py
+CSV_COLUMNS = [
+    "First Name", "Last Name", "Title", "Company", "Email", "Seniority",
+    "Departments", "# Employees", "Industry", "Keywords", "City", "State",
+    "Country", "Company City", "Company State", "Company Country", "Technologies", "Website"
+]
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, min(len(sorted_values), math.ceil(q / 100 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def latency_stats(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1]
+    }
+
+
+def read_peak_rss_mb(pid):
+    """Peak resident set size (VmHWM) of a process in MiB; Linux only, else None."""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss(pid):
+    """Restart VmHWM tracking so the next reading covers one combination only."""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w", encoding="ascii") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+class PeakRssSampler:
+    """Poll a child process's peak RSS until it exits (VmHWM disappears with the process)."""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            value = read_peak_rss_mb(self.pid)
+            if value is not None:
+                self.peak = max(self.peak or 0, value)
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.peak
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_csv(size):
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+    for number in range(size):
+        writer.writerow({
+            "First Name": f"Sam{number}", "Last Name": "Example", "Title": "CTO",
+            "Company": f"Example Corp {number % 97}", "Email": f"sam{number}@example{number % 97}.com",
+            "Seniority": "c_suite", "Departments": "engineering", "# Employees": 150,
+            "Industry": "software", "Keywords": "saas, b2b, cloud", "City": "Berlin", "State": "Berlin",
+            "Country": "Germany", "Company City": "Berlin", "Company State": "Berlin",
+            "Company Country": "Germany", "Technologies": "Python, AWS, React",
+            "Website": f"https://example{number % 97}.com"
+        })
+    return output.getvalue()
+
+
+def fake_search_results(size):
+    return [{
+        "person_data": {
+            "first_name": f"Alex{number}", "last_name": "Example", "title": "Head of Engineering",
+            "email": f"alex{number}@example.com",
+            "organization": {"name": f"Example Corp {number % 97}", "website": f"https://example{number % 97}.com"}
+        },
+        "generated_email_content": [
+            {"Mail Subject": "Quick idea", "Main Email": "Hi Alex, " + "we help teams ship faster. " * 8},
+            {"Second Subject": "Following up", "Second Email": "Hi Alex, just checking in. " * 3}
+        ]
+    } for number in range(size)]
+
+
+def base_env(args, apollo, chat, state_dir):
+    """Environment for main.py/app.py: upstreams point at the stubs, state lives in state_dir."""
+    env = dict(os.environ)
+    env.update({
+        "APOLLO_BASE_URL": f"{apollo.base_url}/api/v1",
+        "APOLLO_API_KEY": "bench",
+        "LLM_MODEL": args.llm_model,
+        "LLM_API_BASE": f"{chat.base_url}/v1",
+        "OPENAI_API_KEY": "bench",
+        "DEEPSEEK_API_KEY": "bench",
+        "PERSON_CACHE_PATH": os.path.join(state_dir, "apollo_cache.sqlite3"),
+        "EMAIL_CACHE_PATH": os.path.join(state_dir, "email_cache.sqlite3"),
+        "CONTACTED_INDEX_PATH": os.path.join(state_dir, "contacted.sqlite3"),
+        "JOBS_DB_PATH": os.path.join(state_dir, "jobs.sqlite3"),
+        "RESULTS_DB_PATH": os.path.join(state_dir, "results.sqlite3"),
+        "TRACE_PATH": os.path.join(state_dir, "traces.jsonl"),
+        "CSV_FILENAME": os.path.join(state_dir, "result.csv"),
+        "APOLLO_MAX_RETRIES": str(args.max_retries),
+        "LLM_MAX_RETRIES": str(args.max_retries),
+    })
+    if not args.keep_rate_limits:
+        # The production ceilings would make the stubs' latency irrelevant
+        env.setdefault("APOLLO_RATE_LIMIT_PER_MINUTE", "1000000")
+        env.setdefault("LLM_RATE_LIMIT_PER_MINUTE", "1000000")
+    return env
+
+
+class Server:
+    """main.py under uvicorn in a subprocess."""
+
+    def __init__(self, env):
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(self.port), "--log-level", "warning"],
+            cwd=REPO_DIR, env=env
+        )
+
+    async def wait_ready(self, timeout=120):
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient(base_url=self.base_url) as client:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"Server exited with status {self.process.returncode}")
+                try:
+                    if (await client.get("/login")).status_code == 200:
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise RuntimeError("Server did not start in time")
+
+    async def login(self):
+        async with httpx.AsyncClient(base_url=self.base_url) as client:
+            response = await client.post("/token", data={"username": USERNAME, "password": PASSWORD})
+            response.raise_for_status()
+            return response.json()["access_token"]
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+async def read_events(response, on_event):
+    async for line in response.aiter_lines():
+        if line.startswith("data: "):
+            on_event(json.loads(line[len("data: "):]))
+
+
+async def peoples_request(client, size, concurrency, args):
+    params = {
+        "per_page": min(size, 100),
+        "max_results": size if size > 100 else 0,
+        "concurrency": concurrency,
+        "batch_size": args.batch_size,
+        "stream_tokens": str(args.stream_tokens).lower(),
+        "use_email_cache": "false",
+        "refresh_cache": "true",
+        "skip_contacted": "false"
+    }
+    start = time.perf_counter()
+    items, errors = [], 0
+
+    def on_event(event):
+        nonlocal errors
+        if event.get("error") or event.get("redirect"):
+            errors += 1
+        elif "result" in event:
+            items.append(time.perf_counter() - start)
+            if not event["result"] or event["result"].get("error"):
+                errors += 1
+
+    async with client.stream("GET", "/peoples/", params=params) as response:
+        await read_events(response, on_event)
+    return time.perf_counter() - start, items, errors
+
+
+async def process_csv_request(client, size, concurrency, args, upload):
+    data = {
+        "stream": "true",
+        "concurrency": str(concurrency),
+        "batch_size": str(args.batch_size),
+        "use_email_cache": "false",
+        "skip_contacted": "false"
+    }
+    start = time.perf_counter()
+    items, errors = [], 0
+
+    def on_event(event):
+        nonlocal errors
+        if event.get("error") is True:
+            errors += 1
+        elif "row_index" in event:
+            items.append(time.perf_counter() - start)
+            if not event.get("row") or not event["row"].get("Main Email"):
+                errors += 1
+
+    async with client.stream("POST", "/process-csv/", data=data, files={"file": ("bench.csv", upload, "text/csv")}) as response:
+        await read_events(response, on_event)
+    return time.perf_counter() - start, items, errors
+
+
+async def export_request(client, size, body):
+    start = time.perf_counter()
+    response = await client.post("/export-csv/", json=body)
+    rows = response.text.count("\n") - 1  # Header line
+    elapsed = time.perf_counter() - start
+    # Every row is "done" when the whole download is; one latency sample per request
+    return elapsed, [elapsed], 0 if response.status_code == 200 and rows >= size else 1
+
+
+async def run_http_scenario(server, token, scenario, size, concurrency, args):
+    cookies = {"access_token": f"Bearer {token}"}
+    headers = {"Authorization": f"Bearer {token}", "accept": "application/json"}
+    timeout = httpx.Timeout(args.timeout)
+    if scenario == "export-csv":
+        # Concurrency is the number of exports downloading at once
+        body = {"results": fake_search_results(size)}
+        parallel = concurrency
+        make_request = lambda client: export_request(client, size, body)
+    elif scenario == "process-csv":
+        upload = make_csv(size).encode("utf-8")
+        parallel = args.parallel
+        make_request = lambda client: process_csv_request(client, size, concurrency, args, upload)
+    else:
+        parallel = args.parallel
+        make_request = lambda client: peoples_request(client, size, concurrency, args)
+
+    reset_peak_rss(server.process.pid)
+    request_latencies, item_latencies, errors = [], [], 0
+    limits = httpx.Limits(max_connections=max(parallel, 1) * 2)
+    async with httpx.AsyncClient(base_url=server.base_url, cookies=cookies, headers=headers, timeout=timeout, limits=limits) as client:
+        semaphore = asyncio.Semaphore(parallel)
+
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                try:
+                    elapsed, items, failed = await make_request(client)
+                except httpx.HTTPError as e:
+                    print(f"{scenario} request failed: {e}", file=sys.stderr)
+                    errors += 1
+                    return
+                request_latencies.append(elapsed)
+                item_latencies.extend(items)
+                errors += failed
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(args.requests)))
+        wall = time.perf_counter() - start
+    return wall, request_latencies, item_latencies, errors, read_peak_rss_mb(server.process.pid)
+
+
+def run_cli_scenario(env, scenario, size, concurrency, args, state_dir):
+    """Run app.py once per request; every row/person is an item, latency is per run."""
+    work_dir = tempfile.mkdtemp(prefix=f"{scenario}-", dir=state_dir)
+    if scenario == "cli-csv":
+        input_path = os.path.join(work_dir, "input.csv")
+        with open(input_path, "w", encoding="utf-8", newline="") as f:
+            f.write(make_csv(size))
+        command = ["--input", input_path, "--output", os.path.join(work_dir, "output.csv")]
+    else:
+        env = {**env, "PER_PAGE": str(min(size, 100)), "PAGE": "1", "PERSON_TITLES": "CTO"}
+        command = ["--max-results", str(size), "--refresh-cache"]
+    command = [sys.executable, os.path.join(REPO_DIR, "app.py"), *command, "--workers", str(concurrency), "--include-contacted"]
+
+    request_latencies, peaks, errors = [], [], 0
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        run_start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        sampler = PeakRssSampler(process.pid)
+        if process.wait() != 0:
+            errors += 1
+        peaks.append(sampler.stop())
+        request_latencies.append(time.perf_counter() - run_start)
+    wall = time.perf_counter() - start
+    peak = max((value for value in peaks if value is not None), default=None)
+    return wall, request_latencies, [], errors, peak
+
+
+def combination_result(scenario, size, concurrency, args, wall, request_latencies, item_latencies, errors, peak_rss_mb):
+    items = len(item_latencies) if scenario in STREAMED_SCENARIOS else size * len(request_latencies)
+    return {
+        "scenario": scenario,
+        "size": size,
+        "concurrency": concurrency,
+        "requests": args.requests,
+        "completed_requests": len(request_latencies),
+        "items": items,
+        "errors": errors,
+        "wall_seconds": wall,
+        "throughput_items_per_second": items / wall if wall else None,
+        "request_latency_seconds": latency_stats(request_latencies),
+        # Time from request start until each result/row event arrived
+        "item_latency_seconds": latency_stats(item_latencies),
+        "peak_rss_mb": peak_rss_mb
+    }
+
+
+async def run(args):
+    apollo_config = StubConfig(args.apollo_latency, args.apollo_error_rate, args.apollo_429_rate, args.retry_after)
+    chat_config = StubConfig(args.llm_latency, args.llm_error_rate, args.llm_429_rate, args.retry_after)
+    apollo = start_apollo_stub(apollo_config, seed=args.seed, total_entries=10 ** 6)
+    chat = start_chat_stub(chat_config, seed=args.seed + 1)
+    scenarios = [name for name in args.scenarios.split(",") if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))} (expected {', '.join(SCENARIOS)})")
+    sizes = [int(value) for value in args.sizes.split(",")]
+    levels = [int(value) for value in args.concurrency.split(",")]
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-") as state_dir:
+        env = base_env(args, apollo, chat, state_dir)
+        server = None
+        try:
+            if any(not name.startswith("cli-") for name in scenarios):
+                server = Server(env)
+                await server.wait_ready()
+                token = await server.login()
+            for scenario in scenarios:
+                for size in sizes:
+                    for concurrency in levels:
+                        if scenario.startswith("cli-"):
+                            measured = await asyncio.to_thread(run_cli_scenario, env, scenario, size, concurrency, args, state_dir)
+                        else:
+                            measured = await run_http_scenario(server, token, scenario, size, concurrency, args)
+                        result = combination_result(scenario, size, concurrency, args, *measured)
+                        results.append(result)
+                        print(
+                            f"{scenario} size={size} concurrency={concurrency}: "
+                            f"{result['throughput_items_per_second'] or 0:.1f} items/s, errors={result['errors']}",
+                            file=sys.stderr
+                        )
+        finally:
+            if server is not None:
+                server.stop()
+            apollo.stop()
+            chat.stop()
+
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "scenarios": scenarios,
+            "sizes": sizes,
+            "concurrency": levels,
+            "requests": args.requests,
+            "parallel": args.parallel,
+            "batch_size": args.batch_size,
+            "stream_tokens": args.stream_tokens,
+            "seed": args.seed,
+            "apollo": apollo_config.to_dict(),
+            "llm": chat_config.to_dict()
+        },
+        "stub_requests": {"apollo": apollo.requests, "llm": chat.requests},
+        "stub_failures": {"apollo": apollo.failures, "llm": chat.failures},
+        "results": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark main.py and app.py against local Apollo/LLM stubs")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--sizes", default="10,50", help="Prospects/rows per request, comma-separated")
+    parser.add_argument("--concurrency", default="1,5", help="Server concurrency / CLI --workers / parallel exports, comma-separated")
+    parser.add_argument("--requests", type=int, default=3, help="Requests (or CLI runs) per combination")
+    parser.add_argument("--parallel", type=int, default=1, help="Requests in flight at once for /peoples/ and /process-csv/")
+    parser.add_argument("--batch-size", type=int, default=1, help="batch_size sent to /peoples/ and /process-csv/")
+    parser.add_argument("--stream-tokens", action="store_true", help="Ask /peoples/ for streamed partial emails")
+    parser.add_argument("--apollo-latency", default="lognormal:0.15,0.4", help="Apollo stub latency (fixed:S, uniform:A,B, normal:MEAN,SD, lognormal:MEDIAN,SIGMA)")
+    parser.add_argument("--llm-latency", default="lognormal:1.5,0.4", help="LLM stub latency, same format")
+    parser.add_argument("--apollo-error-rate", type=float, default=0.0, help="Share of Apollo requests answered with 503")
+    parser.add_argument("--apollo-429-rate", type=float, default=0.0, help="Share of Apollo requests answered with 429")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Share of LLM requests answered with 503")
+    parser.add_argument("--llm-429-rate", type=float, default=0.0, help="Share of LLM requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.2, help="Retry-After seconds sent with stub 429s")
+    parser.add_argument("--max-retries", type=int, default=3, help="APOLLO_MAX_RETRIES and LLM_MAX_RETRIES for the app")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="Keep the configured client-side rate limits instead of lifting them")
+    parser.add_argument("--llm-model", default="openai/bench-model", help="litellm model name routed to the chat stub")
+    parser.add_argument("--timeout", type=float, default=600, help="Client timeout per request in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for stub latencies and failures")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
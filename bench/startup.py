@@ -0,0 +1,125 @@
+"""Measure cold-start time of main.py and app.py and guard against regressions.
+
+    python bench/startup.py --runs 5 --budget main=1.5 --budget app=0.5
+
+Each target is imported in a fresh interpreter (from an empty working
+directory, with a bogus argv) several times. The JSON report gives the
+import time and total process time per target, whether litellm was
+loaded and which files the import created. The exit status is 1 when
+an import loads litellm, creates files, fails, or its median import
+time exceeds its --budget.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TARGETS = ("main", "app")
+
+# Runs inside the child interpreter; an unknown option would have made the old app.py exit at import
+PROBE = """
+import json, os, sys, time
+sys.argv = [sys.argv[0], "--not-an-option"]
+before = set(os.listdir("."))
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "import_seconds": elapsed,
+    "litellm_loaded": "litellm" in sys.modules,
+    "created_files": sorted(set(os.listdir(".")) - before)
+}}))
+"""
+
+
+def probe(module):
+    """Import `module` once in a new interpreter; returns the probe's report plus process time."""
+    with tempfile.TemporaryDirectory(prefix="startup-") as work_dir:
+        env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")]))}
+        start = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module)],
+            cwd=work_dir, env=env, capture_output=True, text=True
+        )
+        process_seconds = time.perf_counter() - start
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f"exit {completed.returncode}"}
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    report["process_seconds"] = process_seconds
+    return report
+
+
+def measure(module, runs):
+    samples = [probe(module) for _ in range(runs)]
+    errors = [sample["error"] for sample in samples if "error" in sample]
+    if errors:
+        return {"target": module, "error": errors[0]}
+    imports = [sample["import_seconds"] for sample in samples]
+    processes = [sample["process_seconds"] for sample in samples]
+    return {
+        "target": module,
+        "runs": runs,
+        "import_seconds": {"min": min(imports), "median": statistics.median(imports), "max": max(imports)},
+        "process_seconds": {"min": min(processes), "median": statistics.median(processes), "max": max(processes)},
+        "litellm_loaded": any(sample["litellm_loaded"] for sample in samples),
+        "created_files": sorted({name for sample in samples for name in sample["created_files"]})
+    }
+
+
+def check(result, budgets):
+    """Return the reasons this target counts as a regression."""
+    if "error" in result:
+        return [f"import failed: {result['error']}"]
+    problems = []
+    if result["litellm_loaded"]:
+        problems.append("litellm is imported at module import time")
+    if result["created_files"]:
+        problems.append(f"import created files: {', '.join(result['created_files'])}")
+    budget = budgets.get(result["target"])
+    if budget is not None and result["import_seconds"]["median"] > budget:
+        problems.append(f"median import time {result['import_seconds']['median']:.3f}s exceeds budget {budget}s")
+    return problems
+
+
+def parse_budget(value):
+    target, _, seconds = value.partition("=")
+    if target not in TARGETS or not seconds:
+        raise argparse.ArgumentTypeError(f"expected TARGET=SECONDS with TARGET in {', '.join(TARGETS)}")
+    return target, float(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import/startup time of main.py and app.py")
+    parser.add_argument("--targets", default=",".join(TARGETS), help=f"Comma-separated subset of {', '.join(TARGETS)}")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per target")
+    parser.add_argument("--budget", type=parse_budget, action="append", default=[], help="Fail when TARGET's median import time exceeds SECONDS, e.g. main=1.5")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    budgets = dict(args.budget)
+    results = []
+    for target in [name for name in args.targets.split(",") if name]:
+        result = measure(target, args.runs)
+        result["problems"] = check(result, budgets)
+        results.append(result)
+
+    report = {"python": sys.version.split()[0], "budgets": budgets, "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    failed = [f"{result['target']}: {problem}" for result in results for problem in result["problems"]]
+    for line in failed:
+        print(line, file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""Local stand-ins for the Apollo API and an OpenAI-compatible chat endpoint.
+
+Both run on the standard library HTTP server in background threads, so a
+benchmark needs no network access, API keys or credits. Every response
+waits for a delay drawn from a LatencyModel and can be turned into a 5xx
+or a 429 (with Retry-After) at configurable rates.
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class LatencyModel:
+    """Random response delay parsed from a spec string.
+
+    "fixed:0.05", "uniform:0.01,0.1", "normal:0.2,0.05" (mean, sd) or
+    "lognormal:0.2,0.5" (median, sigma); all values in seconds.
+    """
+
+    KINDS = ("fixed", "uniform", "normal", "lognormal")
+
+    def __init__(self, spec="fixed:0"):
+        kind, _, values = spec.partition(":")
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution {kind!r} (expected one of {', '.join(self.KINDS)})")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(value) for value in values.split(",") if value.strip()] or [0.0]
+
+    def sample(self, rng):
+        if self.kind == "fixed":
+            delay = self.params[0]
+        elif self.kind == "uniform":
+            delay = rng.uniform(self.params[0], self.params[-1])
+        elif self.kind == "normal":
+            delay = rng.gauss(self.params[0], self.params[1] if len(self.params) > 1 else 0.0)
+        else:
+            sigma = self.params[1] if len(self.params) > 1 else 0.5
+            delay = self.params[0] * rng.lognormvariate(0, sigma)
+        return max(0.0, delay)
+
+
+class StubConfig:
+    def __init__(self, latency="fixed:0", error_rate=0.0, throttle_rate=0.0, retry_after=0.2):
+        self.latency = latency if isinstance(latency, LatencyModel) else LatencyModel(latency)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+
+    def to_dict(self):
+        return {
+            "latency": self.latency.spec,
+            "error_rate": self.error_rate,
+            "throttle_rate": self.throttle_rate,
+            "retry_after": self.retry_after
+        }
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, config, seed=0):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.config = config
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def draw(self):
+        """Return (delay, failure status or None) for one request."""
+        with self.rng_lock:
+            self.requests += 1
+            delay = self.config.latency.sample(self.rng)
+            roll = self.rng.random()
+            status = None
+            if roll < self.config.throttle_rate:
+                status = 429
+            elif roll < self.config.throttle_rate + self.config.error_rate:
+                status = 503
+            if status:
+                self.failures += 1
+            return delay, status
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(body or b"{}")
+        except ValueError:
+            return {}
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def simulate(self):
+        """Sleep for the drawn latency; send and return True if this request should fail."""
+        delay, status = self.server.draw()
+        time.sleep(delay)
+        if status == 429:
+            self.send_json(429, {"error": "rate limited"}, {"Retry-After": str(self.server.config.retry_after)})
+        elif status:
+            self.send_json(status, {"error": "unavailable"})
+        return status is not None
+
+
+def fake_person(person_id):
+    number = int(re.sub(r"\D", "", person_id)[-6:] or 0)
+    return {
+        "id": person_id,
+        "first_name": f"Alex{number}",
+        "last_name": "Example",
+        "title": "Head of Engineering",
+        "headline": "Building reliable software teams",
+        "email": f"alex{number}.{person_id[-8:]}@example.com",
+        "organization": {
+            "name": f"Example Corp {number % 97}",
+            "city": "Berlin",
+            "technology_names": ["Python", "AWS", "PostgreSQL", "Kubernetes", "React"],
+            "industries": ["information technology & services"],
+            "keywords": ["saas", "b2b", "cloud", "developer tools"],
+            "estimated_num_employees": 120 + number % 500,
+            "website_url": f"https://example{number % 97}.com"
+        }
+    }
+
+
+class ApolloHandler(StubHandler):
+    """mixed_people/search, people/match and people/bulk_match under /api/v1."""
+
+    def do_POST(self):
+        path, _, query = self.path.partition("?")
+        payload = self.read_json()
+        if self.simulate():
+            return
+        if path.endswith("/mixed_people/search"):
+            page = int(payload.get("page", 1))
+            per_page = int(payload.get("per_page", 10))
+            total_entries = self.server.total_entries or per_page * page
+            # Ids repeat across requests; run.py keeps them from being skipped or served from cache
+            # (fresh state directory, skip_contacted=false, refresh_cache=true, --include-contacted)
+            start = (page - 1) * per_page
+            people = [{"id": f"{self.server.id_prefix}{number:08d}"} for number in range(start, min(start + per_page, total_entries))]
+            self.send_json(200, {
+                "people": people,
+                "pagination": {"page": page, "per_page": per_page, "total_entries": total_entries, "total_pages": -(-total_entries // per_page)}
+            })
+        elif path.endswith("/people/bulk_match"):
+            details = payload.get("details") or []
+            self.send_json(200, {"matches": [fake_person(detail.get("id", "")) for detail in details]})
+        elif path.endswith("/people/match"):
+            person_id = dict(part.partition("=")[::2] for part in query.split("&") if part).get("id", "")
+            self.send_json(200, {"person": fake_person(person_id)})
+        else:
+            self.send_json(404, {"error": f"unknown path {path}"})
+
+
+def fake_emails(name="there"):
+    return [
+        {"Mail Subject": f"Quick idea for {name}", "Main Email": f"Hi {name}, " + "we help teams like yours ship faster. " * 8},
+        {"Second Subject": "Following up", "Second Email": f"Hi {name}, just checking whether my last note was useful. " * 3}
+    ]
+
+
+class ChatHandler(StubHandler):
+    """OpenAI-compatible POST /v1/chat/completions, with optional streaming.
+
+    Batched prompts ("Prospect P1 profile data: ...") get a JSON object
+    keyed by prospect id; everything else gets a two-email JSON array.
+    """
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        payload = self.read_json()
+        if self.simulate():
+            return
+        prompt = "\n".join(str(message.get("content", "")) for message in payload.get("messages", []))
+        prospect_ids = re.findall(r"Prospect (\S+) profile data:", prompt)
+        if prospect_ids:
+            content = json.dumps({prospect_id: fake_emails() for prospect_id in prospect_ids})
+        else:
+            content = json.dumps(fake_emails())
+        model = payload.get("model", "stub")
+        if payload.get("stream"):
+            self.send_stream(model, content)
+            return
+        self.send_json(200, {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4, "total_tokens": (len(prompt) + len(content)) // 4}
+        })
+
+    def send_stream(self, model, content, chunk_chars=24):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        chunks = [content[start:start + chunk_chars] for start in range(0, len(content), chunk_chars)]
+        for number, text in enumerate(chunks):
+            event = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": "stop" if number == len(chunks) - 1 else None}]
+            }
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_apollo_stub(config, seed=0, id_prefix="bench", total_entries=0):
+    """Start the Apollo stub; point APOLLO_BASE_URL at `<base_url>/api/v1`."""
+    server = StubServer(ApolloHandler, config, seed)
+    server.id_prefix = id_prefix
+    server.total_entries = total_entries
+    return server.start()
+
+
+def start_chat_stub(config, seed=0):
+    """Start the chat stub; point LLM_API_BASE at `<base_url>/v1` with an openai/ model."""
+    return StubServer(ChatHandler, config, seed).start()
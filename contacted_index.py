@@ -0,0 +1,118 @@
+import hashlib
+import math
+import threading
+import time
+
+from cache import connect_sqlite
+
+
+def normalize_email(email):
+    return (email or "").strip().lower()
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings.
+
+    Sized for `capacity` items at `error_rate` false positives; it never
+    gives false negatives, so a miss is a definite "not present".
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, item):
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self._positions(item))
+
+
+class ContactedIndex:
+    """Persistent record of prospects that already got generated emails.
+
+    Prospects are keyed by Apollo id and by normalized email. All keys are
+    loaded into a Bloom filter on first use, so the common "never seen"
+    answer costs no database query; possible hits are confirmed in SQLite.
+    The filter is rebuilt with more room once it holds `capacity` keys.
+    """
+
+    def __init__(self, path, capacity=100000):
+        self.path = path
+        self.capacity = capacity
+        self._conn = None
+        self._filter = None
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = connect_sqlite(self.path)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS contacted (key TEXT PRIMARY KEY, contacted_at REAL NOT NULL)")
+        if self._filter is None:
+            self._build_filter()
+        return self._conn
+
+    def _build_filter(self):
+        keys = [row[0] for row in self._conn.execute("SELECT key FROM contacted")]
+        self.capacity = max(self.capacity, len(keys) * 2)
+        self._filter = BloomFilter(self.capacity)
+        for key in keys:
+            self._filter.add(key)
+        self._count = len(keys)
+
+    @staticmethod
+    def keys_for(person_id=None, email=None):
+        keys = []
+        if person_id:
+            keys.append(f"id:{person_id}")
+        if normalize_email(email):
+            keys.append(f"email:{normalize_email(email)}")
+        return keys
+
+    def contains(self, person_id=None, email=None):
+        """True if the prospect was recorded under its Apollo id or email."""
+        keys = self.keys_for(person_id, email)
+        if not keys:
+            return False
+        with self._lock:
+            conn = self._connect()
+            candidates = [key for key in keys if key in self._filter]
+            if not candidates:
+                return False
+            row = conn.execute(
+                f"SELECT 1 FROM contacted WHERE key IN ({','.join('?' * len(candidates))}) LIMIT 1",
+                candidates
+            ).fetchone()
+        return row is not None
+
+    def add(self, person_id=None, email=None):
+        """Record a prospect under its Apollo id and email."""
+        keys = self.keys_for(person_id, email)
+        if not keys:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            inserted = 0
+            for key in keys:
+                inserted += conn.execute("INSERT OR IGNORE INTO contacted (key, contacted_at) VALUES (?, ?)", (key, now)).rowcount
+                self._filter.add(key)
+            self._count += inserted
+            if self._count > self.capacity:
+                self._build_filter()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._filter = None
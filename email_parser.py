@@ -0,0 +1,195 @@
+import re
+
+# Typographic characters models emit in place of plain ASCII ones
+SMART_CHARACTERS = str.maketrans({"‘": "'", "’": "'", "“": '"', "”": '"'})
+OPEN_QUOTES = {'"': '"', "“": "”"}
+ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", '"': '"', "\\": "\\", "/": "/"}
+
+
+def field_for_key(key):
+    """Map a key such as "Mail Subject", "subject" or "Second Email" to subject/body, or None."""
+    key = re.sub(r"[^a-z]", "", key.lower())
+    if "subject" in key or key in ("title", "headline"):
+        return "subject"
+    if any(word in key for word in ("email", "body", "content", "message", "text", "mail")):
+        return "body"
+    return None
+
+
+class EmailStreamParser:
+    """Tolerant incremental parser for LLM email output.
+
+    Text is fed in chunks as it streams. Anything before the first `[` or
+    `{` (code fences, prose) is ignored and string values are read without
+    requiring the document to be valid JSON, so trailing text, missing
+    commas, raw newlines and smart quotes don't break parsing. Each
+    subject/body is reported by `feed` as soon as its closing quote
+    arrives. Emails are split on object boundaries, or when a flat object
+    repeats a field ("Mail Subject" ... "Second Subject").
+    """
+
+    def __init__(self):
+        self.emails = []
+        self._started = False
+        self._depth = 0
+        self._in_string = None  # Closing quote of the string being read
+        self._escape = None  # Pending escape sequence ("" right after a backslash)
+        self._buffer = []
+        self._key = None
+        self._expect_value = False
+        self._current = None
+
+    def feed(self, chunk):
+        """Consume a chunk and return (email index, field, value) for every field it completed."""
+        completed = []
+        for char in chunk:
+            if self._in_string:
+                self._read_string_char(char, completed)
+            elif not self._started:
+                if char in "[{":
+                    self._started = True
+                    self._structure(char)
+            elif char in OPEN_QUOTES:
+                self._in_string = OPEN_QUOTES[char]
+                self._buffer = []
+            else:
+                self._structure(char)
+        return completed
+
+    def partial(self):
+        """Return (email index, field, text so far) for a subject/body still being streamed, or None."""
+        if not (self._in_string and self._expect_value and self._key and self._depth):
+            return None
+        field = field_for_key(self._key)
+        if field is None:
+            return None
+        index = self._email_index_for(field)
+        return index, field, self._clean("".join(self._buffer))
+
+    def close(self):
+        """Finish parsing and return the emails, keeping a truncated final value if there is one."""
+        current = self.partial()
+        if current and current[2]:
+            self._store(current[1], current[2], [])
+        self._in_string = None
+        return [email for email in self.emails if email["subject"] or email["body"]]
+
+    def _read_string_char(self, char, completed):
+        if self._escape is not None:
+            self._escape += char
+            if self._escape[0] == "u":
+                if len(self._escape) == 5:
+                    try:
+                        self._buffer.append(chr(int(self._escape[1:], 16)))
+                    except ValueError:
+                        self._buffer.append(self._escape[1:])
+                    self._escape = None
+                return
+            self._buffer.append(ESCAPES.get(char, char))
+            self._escape = None
+        elif char == "\\":
+            self._escape = ""
+        elif char == self._in_string:
+            self._in_string = None
+            self._finish_string("".join(self._buffer), completed)
+        else:
+            self._buffer.append(char)
+
+    def _finish_string(self, text, completed):
+        if self._expect_value and self._key is not None:
+            field = field_for_key(self._key)
+            if field is not None and self._depth:
+                self._store(field, self._clean(text), completed)
+            self._key = None
+            self._expect_value = False
+        elif self._depth:
+            self._key = text
+
+    def _structure(self, char):
+        if char in "[{":
+            # A nested container as a value (e.g. {"emails": [...]}) is not itself a field
+            self._depth += 1
+            if char == "{":
+                self._current = None
+            self._key = None
+            self._expect_value = False
+        elif char in "]}":
+            self._depth = max(0, self._depth - 1)
+            if char == "}":
+                self._current = None
+            self._key = None
+            self._expect_value = False
+        elif char == ":" and self._key is not None:
+            self._expect_value = True
+        elif char == ",":
+            self._key = None
+            self._expect_value = False
+
+    def _email_index_for(self, field):
+        if self._current is None or self.emails[self._current][field]:
+            return len(self.emails)
+        return self._current
+
+    def _store(self, field, value, completed):
+        index = self._email_index_for(field)
+        if index == len(self.emails):
+            self.emails.append({"subject": "", "body": ""})
+        self._current = index
+        self.emails[index][field] = value
+        completed.append((index, field, value))
+
+    @staticmethod
+    def _clean(text):
+        return text.translate(SMART_CHARACTERS).strip()
+
+
+def parse_plain_text(text):
+    """Fallback for output without JSON: a "Subject:" line plus the remaining text as the body."""
+    text = re.sub(r"```[a-zA-Z]*", "", text).translate(SMART_CHARACTERS).strip()
+    if not re.search(r"\w", text):
+        return []  # Empty, or an empty JSON structure such as "[]"
+    match = re.search(r"^\W*subject\W*:\s*(.+)$", text, re.IGNORECASE | re.MULTILINE)
+    if match:
+        body = (text[:match.start()] + text[match.end():]).strip()
+        body = re.sub(r"^\W*(body|email)\W*:\s*", "", body, flags=re.IGNORECASE)
+        return [{"subject": match.group(1).strip(), "body": body}]
+    return [{"subject": "", "body": text}]
+
+
+def parse_emails(text):
+    """Parse complete LLM output into a list of {"subject", "body"} dicts.
+
+    Never raises: output the JSON reader cannot use is kept as plain text
+    so a paid generation is not thrown away.
+    """
+    parser = EmailStreamParser()
+    parser.feed(text or "")
+    return parser.close() or parse_plain_text(text or "")
+
+
+def parse_batched_emails(text, prospect_ids):
+    """Split a batched response into {prospect id: [{"subject", "body"}, ...]}.
+
+    Each prospect's section runs from its quoted key to the next prospect's
+    key and is read on its own, so one malformed section doesn't lose the
+    others. Prospects that are absent, or have no email with both subject
+    and body, are left out; a value cut off by truncated output is dropped.
+    """
+    text = text or ""
+    sections = []
+    for prospect_id in prospect_ids:
+        match = re.search(r'["“]' + re.escape(str(prospect_id)) + r'["”]\s*:', text)
+        if match:
+            sections.append((match.end(), prospect_id))
+    sections.sort()
+
+    results = {}
+    for position, (start, prospect_id) in enumerate(sections):
+        end = sections[position + 1][0] if position + 1 < len(sections) else len(text)
+        parser = EmailStreamParser()
+        parser.feed(text[start:end])
+        # Only fields whose closing quote arrived are in parser.emails (no close())
+        emails = [email for email in parser.emails if email["subject"] and email["body"]]
+        if emails:
+            results[prospect_id] = emails
+    return results
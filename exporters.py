@@ -0,0 +1,69 @@
+import csv
+import io
+import json
+import zlib
+
+# Rows serialized between yields; each chunk is sent as soon as it is ready
+EXPORT_CHUNK_ROWS = 500
+
+
+def iter_csv(columns, rows, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield CSV text for `columns` and `rows` (lists of values), `chunk_rows` rows at a time."""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % chunk_rows == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+    yield output.getvalue()
+
+
+def iter_jsonl(columns, rows, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield one JSON object per row, keyed by `columns`, `chunk_rows` lines at a time."""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+        if len(lines) == chunk_rows:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+
+FORMATS = {
+    "csv": ("text/csv", "csv", iter_csv),
+    "jsonl": ("application/x-ndjson", "jsonl", iter_jsonl),
+}
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip-compress a stream of text chunks incrementally."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(columns, rows, fmt="csv", compress=False):
+    """Return (chunks, media type, file extension, headers) for a streamed export.
+
+    `rows` may be any iterable (e.g. a generator over stored results);
+    it is consumed lazily, so memory stays flat however many rows there
+    are. With `compress` the body is gzip content-encoded.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    media_type, extension, serializer = FORMATS[fmt]
+    chunks = serializer(columns, rows)
+    headers = {}
+    if compress:
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    else:
+        chunks = (chunk.encode("utf-8") for chunk in chunks)
+    return chunks, media_type, extension, headers
@@ -0,0 +1,242 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+
+from cache import connect_sqlite
+
+# Job lifecycle: queued -> running -> completed | failed | cancelled
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class JobStore:
+    """SQLite-backed storage for background CSV jobs and their rows.
+
+    Every input row is stored at submission time with a pending status and
+    gets its output written as soon as it is processed, so a job can resume
+    from the last completed row after a restart. Finished, failed and
+    cancelled jobs are deleted with their rows `ttl` seconds after their
+    last status change; expiry runs on startup and whenever a job is created.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = connect_sqlite(self.path)
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, owner TEXT, status TEXT NOT NULL, filename TEXT,"
+                " params TEXT NOT NULL, columns TEXT NOT NULL, total_rows INTEGER NOT NULL,"
+                " error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS job_rows ("
+                " job_id TEXT NOT NULL, row_index INTEGER NOT NULL, input TEXT NOT NULL,"
+                " output TEXT, status TEXT NOT NULL DEFAULT 'pending',"
+                " PRIMARY KEY (job_id, row_index));"
+            )
+        return self._conn
+
+    def create_job(self, rows, columns, params, owner=None, filename=None):
+        """Store a new queued job with its input rows and return its id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            self._evict(conn, now)
+            conn.execute("BEGIN")
+            conn.execute(
+                "INSERT INTO jobs (id, owner, status, filename, params, columns, total_rows, created_at, updated_at)"
+                " VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, owner, filename, json.dumps(params), json.dumps(columns), len(rows), now, now)
+            )
+            conn.executemany(
+                "INSERT INTO job_rows (job_id, row_index, input) VALUES (?, ?, ?)",
+                ((job_id, index, json.dumps(row)) for index, row in enumerate(rows))
+            )
+            conn.execute("COMMIT")
+        return job_id
+
+    def _evict(self, conn, now):
+        if not self.ttl:
+            return
+        expired = [row[0] for row in conn.execute(
+            f"SELECT id FROM jobs WHERE status NOT IN ({','.join('?' * len(ACTIVE_STATUSES))}) AND updated_at < ?",
+            (*ACTIVE_STATUSES, now - self.ttl)
+        )]
+        if expired:
+            placeholders = ",".join("?" * len(expired))
+            conn.execute("BEGIN")
+            conn.execute(f"DELETE FROM job_rows WHERE job_id IN ({placeholders})", expired)
+            conn.execute(f"DELETE FROM jobs WHERE id IN ({placeholders})", expired)
+            conn.execute("COMMIT")
+
+    def purge_expired(self):
+        """Delete stopped jobs (and their rows) older than `ttl`."""
+        with self._lock:
+            self._evict(self._connect(), time.time())
+
+    def get_job(self, job_id):
+        """Return the job record with row counters, or None."""
+        with self._lock:
+            conn = self._connect()
+            job = conn.execute(
+                "SELECT id, owner, status, filename, params, columns, total_rows, error, created_at, updated_at"
+                " FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM job_rows WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+        completed = counts.get("done", 0) + counts.get("skipped", 0)
+        return {
+            "id": job[0],
+            "owner": job[1],
+            "status": job[2],
+            "filename": job[3],
+            "params": json.loads(job[4]),
+            "columns": json.loads(job[5]),
+            "total_rows": job[6],
+            "completed_rows": completed,
+            "succeeded_rows": counts.get("done", 0),
+            "progress": (completed / job[6] * 100) if job[6] else 100,
+            "error": job[7],
+            "created_at": job[8],
+            "updated_at": job[9]
+        }
+
+    def set_status(self, job_id, status, error=None):
+        with self._lock:
+            self._connect().execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id)
+            )
+
+    def active_job_ids(self):
+        """Ids of jobs that were queued or running, oldest first."""
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT id FROM jobs WHERE status IN ({','.join('?' * len(ACTIVE_STATUSES))}) ORDER BY created_at",
+                ACTIVE_STATUSES
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def pending_rows(self, job_id):
+        """Yield (row_index, row) for rows not processed yet, in input order."""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT row_index, input FROM job_rows WHERE job_id = ? AND status = 'pending' ORDER BY row_index",
+                (job_id,)
+            ).fetchall()
+        for row_index, row in rows:
+            yield row_index, json.loads(row)
+
+    def complete_row(self, job_id, row_index, output):
+        """Record a processed row; `output` None marks it as skipped."""
+        with self._lock:
+            self._connect().execute(
+                "UPDATE job_rows SET output = ?, status = ? WHERE job_id = ? AND row_index = ?",
+                (json.dumps(output) if output is not None else None, "done" if output is not None else "skipped", job_id, row_index)
+            )
+
+    def completed_outputs(self, job_id, chunk_size=500):
+        """Yield output rows processed so far, in input order, `chunk_size` rows per query."""
+        last_index = -1
+        while True:
+            with self._lock:
+                rows = self._connect().execute(
+                    "SELECT row_index, output FROM job_rows WHERE job_id = ? AND status = 'done' AND row_index > ?"
+                    " ORDER BY row_index LIMIT ?",
+                    (job_id, last_index, chunk_size)
+                ).fetchall()
+            for _, output in rows:
+                yield json.loads(output)
+            if len(rows) < chunk_size:
+                return
+            last_index = rows[-1][0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class JobRunner:
+    """Run stored jobs in background asyncio tasks.
+
+    `process_row(params, row)` is awaited for each pending row and returns
+    the output row, or None to skip it. At most `max_jobs` jobs run at once
+    and each processes up to `row_concurrency` rows in parallel.
+    """
+
+    def __init__(self, store, process_row, max_jobs=1, row_concurrency=5):
+        self.store = store
+        self.process_row = process_row
+        self.row_concurrency = row_concurrency
+        self._job_slots = asyncio.Semaphore(max_jobs)
+        self._tasks = {}
+
+    def start(self):
+        """Drop expired jobs, then resume every job left queued or running by a previous process."""
+        self.store.purge_expired()
+        for job_id in self.store.active_job_ids():
+            self.submit(job_id)
+
+    def submit(self, job_id):
+        if job_id not in self._tasks:
+            task = asyncio.create_task(self._run(job_id))
+            self._tasks[job_id] = task
+            task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    def cancel(self, job_id):
+        """Cancel a job; rows already processed stay available for download."""
+        job = self.store.get_job(job_id)
+        if job is None or job["status"] not in ACTIVE_STATUSES:
+            return False
+        self.store.set_status(job_id, "cancelled")
+        task = self._tasks.get(job_id)
+        if task:
+            task.cancel()
+        return True
+
+    async def _run(self, job_id):
+        async with self._job_slots:
+            job = self.store.get_job(job_id)
+            if job is None or job["status"] not in ACTIVE_STATUSES:
+                return
+            self.store.set_status(job_id, "running")
+            params = job["params"]
+            rows = self.store.pending_rows(job_id)
+
+            # A fixed pool of workers pulls from the shared pending-row iterator
+            async def worker():
+                for row_index, row in rows:
+                    output = await self.process_row(params, row)
+                    self.store.complete_row(job_id, row_index, output)
+
+            workers = [asyncio.create_task(worker()) for _ in range(self.row_concurrency)]
+            try:
+                await asyncio.gather(*workers)
+            except asyncio.CancelledError:
+                # Cancelled by the user, or by shutdown (the job stays running and resumes on restart)
+                for task in workers:
+                    task.cancel()
+                raise
+            except Exception as e:
+                for task in workers:
+                    task.cancel()
+                self.store.set_status(job_id, "failed", error=str(e))
+                return
+            self.store.set_status(job_id, "completed")
+
+    async def shutdown(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
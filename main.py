@@ -6,21 +6,62 @@ import time
 import argparse
 import io
 import asyncio
+import hashlib
+import importlib
 import httpx
 from dotenv import load_dotenv
-from litellm import completion
 from fastapi import FastAPI, File, UploadFile, Query, Request, HTTPException, Depends, Form
-from fastapi.responses import FileResponse, StreamingResponse, RedirectResponse, JSONResponse
+from fastapi.responses import FileResponse, StreamingResponse, RedirectResponse, JSONResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 import shutil
+import tempfile
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates  
 from fastapi.responses import HTMLResponse
 import jwt
 from datetime import datetime, timedelta
 from typing import Optional
+from contextlib import asynccontextmanager
+from cache import SQLiteCache
+from contacted_index import ContactedIndex
+from prompts import PromptBuilder
+from profile_format import estimate_message_tokens
+from email_parser import EmailStreamParser, parse_emails, parse_batched_emails
+from jobs import JobStore, JobRunner
+from result_store import ResultStore
+from exporters import export_stream
+from rate_limit import get_limiter, acall_with_retries
+from metrics import (
+    REGISTRY, APOLLO_SEARCH_SECONDS, APOLLO_MATCH_SECONDS, LLM_GENERATION_SECONDS, EMAIL_PARSE_SECONDS,
+    CSV_IO_SECONDS, ERRORS_TOTAL, count_retry, record_cache_stats, timed_iter
+)
+from tracing import SamplingProfiler, current_span, new_trace_id, span, start_trace
 
-app = FastAPI() 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled keep-alive client shared by every Apollo call
+    app.state.apollo_client = create_apollo_client()
+    # Background CSV jobs; anything left unfinished by a previous run resumes here
+    app.state.job_runner = JobRunner(job_store, process_job_row, max_jobs=JOB_MAX_RUNNING, row_concurrency=MAX_CONCURRENCY)
+    app.state.job_runner.start()
+    if LITELLM_PRELOAD:
+        # Import litellm before accepting requests instead of on the first completion
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, importlib.import_module, "litellm")
+        except Exception as e:
+            print(f"Preloading litellm failed; it will be imported on first use: {e}")
+    try:
+        yield
+    finally:
+        await app.state.job_runner.shutdown()
+        await app.state.apollo_client.aclose()
+        person_cache.close()
+        email_cache.close()
+        contacted_index.close()
+        job_store.close()
+        result_store.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Mount static files directory
 # app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -35,9 +76,97 @@ APOLLO_API_KEY = os.getenv("APOLLO_API_KEY")
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY") 
 CSV_FILENAME = "result.csv"  
 INITIAL_DEEPSEEK_PROMPT=os.getenv("INITIAL_DEEPSEEK_PROMPT")
+COMPANY_OVERVIEW_PATH = os.getenv("COMPANY_OVERVIEW_PATH", "Nobisoft_Company_Overview.txt")
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")  # You should set this in .env
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60  # Set to 60 minutes for better user experience
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", 5))  # Prospects enriched/generated in parallel
+
+APOLLO_BASE_URL = os.getenv("APOLLO_BASE_URL", "https://api.apollo.io/api/v1").rstrip("/")
+APOLLO_BATCH_SIZE = int(os.getenv("APOLLO_BATCH_SIZE", 10))  # Ids per people/bulk_match request (Apollo allows up to 10)
+
+# Persistent cache of Apollo person records, keyed by person id (shared with app.py)
+PERSON_CACHE_PATH = os.getenv("PERSON_CACHE_PATH", "apollo_cache.sqlite3")
+PERSON_CACHE_TTL = int(os.getenv("PERSON_CACHE_TTL", 7 * 24 * 3600))  # Seconds
+PERSON_CACHE_MAX_ENTRIES = int(os.getenv("PERSON_CACHE_MAX_ENTRIES", 50000))
+person_cache = SQLiteCache(PERSON_CACHE_PATH, table="apollo_people", ttl=PERSON_CACHE_TTL, max_entries=PERSON_CACHE_MAX_ENTRIES)
+
+# Apollo HTTP connection pool settings
+APOLLO_MAX_CONNECTIONS = int(os.getenv("APOLLO_MAX_CONNECTIONS", 20))
+APOLLO_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("APOLLO_MAX_KEEPALIVE_CONNECTIONS", 10))
+APOLLO_KEEPALIVE_EXPIRY = float(os.getenv("APOLLO_KEEPALIVE_EXPIRY", 30))
+APOLLO_TIMEOUT = float(os.getenv("APOLLO_TIMEOUT", 30))
+APOLLO_CONNECT_TIMEOUT = float(os.getenv("APOLLO_CONNECT_TIMEOUT", 10))
+APOLLO_HTTP2 = os.getenv("APOLLO_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# Process-wide rate limits and retry policy per upstream (429 Retry-After, 5xx and timeouts are retried)
+APOLLO_RATE_LIMIT_PER_MINUTE = float(os.getenv("APOLLO_RATE_LIMIT_PER_MINUTE", 200))
+APOLLO_MAX_RETRIES = int(os.getenv("APOLLO_MAX_RETRIES", 3))
+LLM_RATE_LIMIT_PER_MINUTE = float(os.getenv("LLM_RATE_LIMIT_PER_MINUTE", 600))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+apollo_limiter = get_limiter("apollo", APOLLO_RATE_LIMIT_PER_MINUTE)
+llm_limiter = get_limiter("llm", LLM_RATE_LIMIT_PER_MINUTE)
+
+# LLM generation settings
+LLM_MODEL = os.getenv("LLM_MODEL", "deepseek/deepseek-chat")
+LLM_API_BASE = os.getenv("LLM_API_BASE") or None  # Override the provider endpoint (e.g. an OpenAI-compatible stub)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 120))  # Seconds per completion call
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 10))  # Completion calls in flight across all requests
+llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+LLM_STREAM_INTERVAL = float(os.getenv("LLM_STREAM_INTERVAL", 0.1))  # Min seconds between partial-text events per prospect
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", 1))  # Prospects per completion call (1 = one call per prospect)
+LITELLM_PRELOAD = os.getenv("LITELLM_PRELOAD", "false").lower() in ("1", "true", "yes")  # Import litellm at startup rather than lazily
+
+# Background CSV job storage
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.sqlite3")
+JOB_MAX_RUNNING = int(os.getenv("JOB_MAX_RUNNING", 1))  # Jobs processed at the same time
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1.0))  # Seconds between job progress events
+JOBS_TTL = int(os.getenv("JOBS_TTL", 7 * 24 * 3600))  # Seconds a stopped job and its rows are kept (0 = forever)
+job_store = JobStore(JOBS_DB_PATH, ttl=JOBS_TTL)
+
+# Search and CSV run results kept server-side for export and paging by run id
+RESULTS_DB_PATH = os.getenv("RESULTS_DB_PATH", "results.sqlite3")
+RESULTS_TTL = int(os.getenv("RESULTS_TTL", 24 * 3600))  # Seconds a run is kept after its last update
+RESULTS_MAX_RUNS = int(os.getenv("RESULTS_MAX_RUNS", 200))  # Older runs are evicted beyond this count
+result_store = ResultStore(RESULTS_DB_PATH, ttl=RESULTS_TTL, max_runs=RESULTS_MAX_RUNS)
+
+# Per-request tracing (`trace=true`): spans of each traced run are appended to TRACE_PATH as OTLP/JSON lines
+TRACE_PATH = os.getenv("TRACE_PATH", "traces.jsonl")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")  # Folded stacks of `profile=true` requests
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))  # Seconds between profiler samples
+
+# Static prompt prefix (base prompt + company overview + output format), reloaded when the overview file changes
+EMAIL_OUTPUT_INSTRUCTIONS = (
+    "The result should only be in JSON format like this:\n"
+    "[\n"
+    "    {\n"
+    "        \"Mail Subject\": \"Hey John, Special Offer!\",\n"
+    "        \"Main Email\": \"Hey John, we have an exclusive discount for Acme Corp!\"\n"
+    "    },\n"
+    "    {\n"
+    "        \"Second Subject\": \"Following up on my last email\",\n"
+    "        \"Second Email\": \"Hey John, just checking if you saw my last email about the Acme Corp discount!\"\n"
+    "    }\n"
+    "]"
+)
+PROFILE_TOKEN_BUDGET = int(os.getenv("PROFILE_TOKEN_BUDGET", 400))  # Estimated tokens per serialized profile (0 = no limit)
+prompt_builder = PromptBuilder(
+    INITIAL_DEEPSEEK_PROMPT,
+    overview_path=COMPANY_OVERVIEW_PATH,
+    output_instructions=EMAIL_OUTPUT_INSTRUCTIONS,
+    profile_token_budget=PROFILE_TOKEN_BUDGET
+)
+
+# Content-addressed cache of parsed email generations, keyed by a hash of model + prompt
+EMAIL_CACHE_PATH = os.getenv("EMAIL_CACHE_PATH", "email_cache.sqlite3")
+EMAIL_CACHE_TTL = int(os.getenv("EMAIL_CACHE_TTL", 30 * 24 * 3600))  # Seconds
+EMAIL_CACHE_MAX_ENTRIES = int(os.getenv("EMAIL_CACHE_MAX_ENTRIES", 20000))
+email_cache = SQLiteCache(EMAIL_CACHE_PATH, table="generated_emails", ttl=EMAIL_CACHE_TTL, max_entries=EMAIL_CACHE_MAX_ENTRIES)
+
+# Prospects that already got generated emails, by Apollo id and email; skipped unless a request opts out
+CONTACTED_INDEX_PATH = os.getenv("CONTACTED_INDEX_PATH", "contacted.sqlite3")
+SKIP_CONTACTED = os.getenv("SKIP_CONTACTED", "true").lower() in ("1", "true", "yes")
+contacted_index = ContactedIndex(CONTACTED_INDEX_PATH)
 
 # This would typically come from a database
 FAKE_USERS_DB = {
@@ -56,6 +185,44 @@ HEADERS = {
     "X-Api-Key": APOLLO_API_KEY
 }
 
+def create_apollo_client():
+    """Build the pooled HTTP client used for all Apollo requests."""
+    http2 = APOLLO_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401 - HTTP/2 support is optional (pip install httpx[http2])
+        except ImportError:
+            print("APOLLO_HTTP2 is enabled but the 'h2' package is not installed; falling back to HTTP/1.1")
+            http2 = False
+
+    return httpx.AsyncClient(
+        # Without APOLLO_API_KEY the header is left out so the app still starts; Apollo then rejects the calls
+        headers={name: value for name, value in HEADERS.items() if value is not None},
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=APOLLO_MAX_CONNECTIONS,
+            max_keepalive_connections=APOLLO_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=APOLLO_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(APOLLO_TIMEOUT, connect=APOLLO_CONNECT_TIMEOUT)
+    )
+
+def get_apollo_client():
+    """Return the shared Apollo client, creating it if the lifespan hook has not run."""
+    client = getattr(app.state, "apollo_client", None)
+    if client is None or client.is_closed:
+        client = app.state.apollo_client = create_apollo_client()
+    return client
+
+async def apollo_post(url, **kwargs):
+    """POST to Apollo through the shared client, rate limiter and retry policy."""
+    return await acall_with_retries(
+        lambda: get_apollo_client().post(url, **kwargs),
+        limiter=apollo_limiter,
+        max_retries=APOLLO_MAX_RETRIES,
+        on_retry=count_retry("apollo")
+    )
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -209,9 +376,21 @@ async def search_people(
     deepseek_prompt: str = Query("", description="Deepseek prompt"),
     your_name: str = Query("", description="Your name"),
     your_position: str = Query("", description="Your position"),
-    your_contact: str = Query("", description="Your contact information")
+    your_contact: str = Query("", description="Your contact information"),
+    concurrency: int = Query(MAX_CONCURRENCY, ge=1, le=50, description="Number of people processed in parallel"),
+    final_results: bool = Query(False, description="Include the full result list in the final summary event"),
+    refresh_cache: bool = Query(False, description="Bypass cached Apollo person data and fetch it fresh"),
+    use_email_cache: bool = Query(True, description="Reuse previously generated emails for identical prompts"),
+    max_results: int = Query(0, ge=0, description="Walk search pages from `page` until this many people are processed (0 = only one page)"),
+    stream_tokens: bool = Query(False, description="Send partial email subject/body text while it is being generated"),
+    batch_size: int = Query(LLM_BATCH_SIZE, ge=1, le=10, description="Prospects per email generation call (partial text is not streamed when > 1)"),
+    skip_contacted: bool = Query(SKIP_CONTACTED, description="Skip prospects that already got generated emails"),
+    trace: bool = Query(False, description="Record a trace of this search in TRACE_PATH"),
+    profile: bool = Query(False, description="Also sample the event loop's stacks into PROFILE_DIR (implies trace)")
 ):
     """Search for people using Apollo API with streaming progress updates."""
+    trace_id = new_trace_id() if trace or profile else None
+
     async def generate():
         # Get token from cookie
         token = None
@@ -248,201 +427,823 @@ async def search_people(
             "per_page": per_page
         }.items() if v and v != [""]}
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.apollo.io/api/v1/mixed_people/search",
-                headers=HEADERS,
-                json=search_payload
-            )
-        
-        if response.status_code == 200:
-            data = response.json()
-            people_ids = [person["id"] for person in data.get("people", [])]
-            total_people = len(people_ids)
-            results = []
-
-            async def process_person(people_id):
-                person_data = await fetch_person_data(people_id)
-                if person_data:
-                    generated_email_content = await generate_email_content(person_data, deepseek_prompt, your_name, your_position, your_contact)
-                    return {
-                        "person_data": person_data,
-                        "generated_email_content": generated_email_content
-                    }
+        # Results are stored under run_id as they finish; exports and paging only need the id
+        run_id = result_store.create_run("search", owner=username)
+        run_status = "incomplete"
+        results = []
+        completed = 0
+        cached = 0
+        total_people = 0
+        offset = 0
+        prompt_tokens = 0
+        skipped = 0
+        skipped_before_fetch = 0
+        sender = {"name": your_name, "position": your_position, "contact": your_contact}
+        positions = {}
+        # Partial generations are queued by the workers and interleaved with finished results
+        partials = asyncio.Queue() if stream_tokens and batch_size == 1 else None
+
+        def already_contacted(person_data):
+            nonlocal skipped
+            if skip_contacted and contacted_index.contains(email=person_data.get("email")):
+                skipped += 1
+                return True
+            return False
+
+        def record_contacted(people_id, person_data, result):
+            if result["generated_email_content"]:
+                contacted_index.add(people_id, person_data.get("email"))
+            return result
+
+        async def process_person(people_id):
+            with span("prospect", person_id=people_id, index=positions[people_id]) as prospect_span:
+                with span("apollo.match", cached=people_id in fetcher.cached):
+                    person_data = await fetcher.get(people_id)
+                if person_data and not already_contacted(person_data):
+                    on_partial = None
+                    if partials is not None:
+                        index = positions[people_id]
+                        sent_person = False
+
+                        def on_partial(email, field, text):
+                            nonlocal sent_person
+                            event = {"index": index, "email": email, "field": field, "text": text}
+                            if not sent_person:
+                                event["person_data"] = person_data
+                                sent_person = True
+                            partials.put_nowait(event)
+                    try:
+                        generated_email_content = await generate_email_content(person_data, deepseek_prompt, your_name, your_position, your_contact, use_cache=use_email_cache, on_partial=on_partial)
+                    except Exception as e:
+                        generated_email_content = e
+                    return record_contacted(people_id, person_data, person_result(person_data, generated_email_content))
+                prospect_span.set(skipped=True)
                 return None
-            
-            results = []
-            for index, people_id in enumerate(people_ids):
-                result = await process_person(people_id)
-                if result:
-                    results.append(result)
-                
-                # Calculate and send progress with chunked encoding
-                progress = ((index + 1) / total_people) * 100
-                response_data = {
-                    "success": True,
-                    "in_progress": True,
-                    "progress": progress,
-                    "total_people": total_people,
-                    "results": results
-                }
-                progress_update = "data: " + json.dumps(response_data) + "\n\n"
-                yield progress_update.encode('utf-8')
-                await asyncio.sleep(0.1)  # Small delay to ensure updates are sent
 
-            # Send final response with chunked encoding to prevent buffering
-            final_response = "data: " + json.dumps({
-                "success": True,
-                "in_progress": False,
-                "progress": 100,
-                "total_people": total_people,
-                "results": results
-            }) + "\n\n"
-            yield final_response.encode('utf-8')
-        elif response.status_code == 401:
-            yield ("data: " + json.dumps({"redirect": "/login"}) + "\n\n").encode('utf-8')
-        else:
-            print(response)
-            error_response = "data: " + json.dumps({
-                "error": f"API request failed with status {response.status_code}",
-                "details": response.text[:500]
-            }) + "\n\n"
-            yield error_response.encode('utf-8')
+        async def process_people_batch(batch_ids):
+            with span("apollo.match", prospects=len(batch_ids)):
+                people = await asyncio.gather(*(fetcher.get(people_id) for people_id in batch_ids))
+            people = [person_data if person_data and not already_contacted(person_data) else None for person_data in people]
+            found = [person_data for person_data in people if person_data]
+            generated = iter(await generate_email_batch(found, deepseek_prompt, your_name, your_position, your_contact, use_cache=use_email_cache))
+            return [
+                record_contacted(people_id, person_data, person_result(person_data, next(generated))) if person_data else None
+                for people_id, person_data in zip(batch_ids, people)
+            ]
 
-    return StreamingResponse(generate(), media_type="text/event-stream")
+        # The next page is fetched while this page's people are being processed
+        pages = iter_search_pages(search_payload, max_results)
+        try:
+            async for page_number, response, people_ids in pages:
+                if response.status_code != 200:
+                    if page_number != page:
+                        # Keep what earlier pages produced and finish normally
+                        print(f"Stopping pagination at page {page_number}: status {response.status_code}")
+                        break
+                    run_status = "failed"
+                    if response.status_code == 401:
+                        yield ("data: " + json.dumps({"redirect": "/login"}) + "\n\n").encode('utf-8')
+                    else:
+                        print(response)
+                        error_response = "data: " + json.dumps({
+                            "error": f"API request failed with status {response.status_code}",
+                            "details": response.text[:500]
+                        }) + "\n\n"
+                        yield error_response.encode('utf-8')
+                    return
+
+                if page_number == page:
+                    total_people = expected_result_count(response.json(), len(people_ids), page, per_page, max_results)
+                total_people = max(total_people, offset + len(people_ids))
+                page_size = len(people_ids)
+
+                # Known prospects are dropped before any Apollo or DeepSeek call
+                if skip_contacted:
+                    fresh_ids = [people_id for people_id in people_ids if not contacted_index.contains(person_id=people_id)]
+                    skipped += len(people_ids) - len(fresh_ids)
+                    skipped_before_fetch += len(people_ids) - len(fresh_ids)
+                    people_ids = fresh_ids
+
+                fetcher = BulkPersonFetcher(people_ids, refresh=refresh_cache)
+                cached += fetcher.cache_hits
+                positions = {people_id: offset + local_index for local_index, people_id in enumerate(people_ids)}
+
+                # Each progress event carries only the newly finished record (or null).
+                # Results arrive in completion order; "index" lets the client restore search order
+                try:
+                    if batch_size > 1:
+                        outcomes = run_batched(people_ids, process_people_batch, batch_size, concurrency)
+                    else:
+                        outcomes = run_bounded(people_ids, process_person, concurrency)
+                    async for kind, item in with_partials(outcomes, partials):
+                        if kind == "partial":
+                            yield sse_event({"success": True, "in_progress": True, "partial": item})
+                            continue
+                        local_index, result = item
+                        completed += 1
+                        if result:
+                            result["index"] = offset + local_index
+                            # Estimated size of this prospect's single-call prompt
+                            result["prompt_tokens"] = estimate_message_tokens(prompt_builder.build_messages(result["person_data"], deepseek_prompt, sender=sender))
+                            prompt_tokens += result["prompt_tokens"]
+                            results.append(result)
+                            result_store.add_result(run_id, result["index"], result)
+
+                        yield sse_event({
+                            "success": True,
+                            "in_progress": True,
+                            "progress": min((completed + skipped_before_fetch) / total_people * 100, 100),
+                            "completed": completed,
+                            "skipped": skipped,
+                            "total_people": total_people,
+                            "page": page_number,
+                            "run_id": run_id,
+                            "result": result
+                        })
+                finally:
+                    fetcher.close()
+                offset += page_size
+            run_status = "completed"
+        finally:
+            await pages.aclose()
+            result_store.finish_run(run_id, run_status)
+
+        # Final summary event
+        summary = {
+            "success": True,
+            "in_progress": False,
+            "progress": 100,
+            "completed": completed,
+            "succeeded": len(results),
+            "cached": cached,
+            "skipped": skipped,
+            "prompt_tokens": prompt_tokens,
+            # Same basis as the progress events: prospects skipped before enrichment count too
+            "total_people": completed + skipped_before_fetch,
+            "run_id": run_id
+        }
+        if trace_id:
+            summary["trace_id"] = trace_id
+            current_span().set(run_id=run_id, completed=completed, succeeded=len(results), skipped=skipped, cached=cached)
+        if final_results:
+            summary["results"] = results
+        yield sse_event(summary)
+
+    events = traced(generate(), "search", trace_id, profile, page=page, per_page=per_page, max_results=max_results, batch_size=batch_size, concurrency=concurrency)
+    return StreamingResponse(events, media_type="text/event-stream")
+
+async def traced(events, name, trace_id, profile=False, **attributes):
+    """Pass `events` through, inside a trace named `name` when trace_id is set.
+
+    The trace (and the profile, with `profile`) is written when the events
+    end, including when the client disconnects early.
+    """
+    if not trace_id:
+        async for event in events:
+            yield event
+        return
+    profiler = SamplingProfiler(PROFILE_DIR, PROFILE_INTERVAL) if profile else None
+    with start_trace(name, TRACE_PATH, trace_id=trace_id, profiler=profiler, **attributes):
+        async for event in events:
+            yield event
+
+async def iter_search_pages(search_payload, max_results=0):
+    """Yield (page, response, new people ids) for consecutive Apollo search pages.
+
+    Starts at search_payload["page"]. With max_results 0 only that page is
+    fetched; otherwise pages are walked until max_results unique people
+    have been yielded or the reported page count is reached. Page N+1 is
+    requested as soon as page N arrives, so it downloads while the caller
+    processes page N. Ids already seen on earlier pages are dropped.
+    """
+    url = f"{APOLLO_BASE_URL}/mixed_people/search"
+    page_number = search_payload.get("page", 1)
+    seen = set()
+
+    async def fetch_page(page):
+        with span("apollo.search", page=page) as search_span, APOLLO_SEARCH_SECONDS.time():
+            response = await apollo_post(url, json={**search_payload, "page": page})
+            search_span.set(status=response.status_code, response_bytes=len(response.content))
+            return response
+
+    next_fetch = asyncio.create_task(fetch_page(page_number))
+    try:
+        while next_fetch is not None:
+            response = await next_fetch
+            next_fetch = None
+            if response.status_code != 200:
+                ERRORS_TOTAL.inc(stage="apollo_search")
+                yield page_number, response, []
+                return
+
+            data = response.json()
+            people_ids = []
+            for person in data.get("people", []):
+                if person["id"] not in seen and (not max_results or len(seen) < max_results):
+                    seen.add(person["id"])
+                    people_ids.append(person["id"])
+
+            total_pages = (data.get("pagination") or {}).get("total_pages") or page_number
+            if max_results and len(seen) < max_results and page_number < total_pages and data.get("people"):
+                next_fetch = asyncio.create_task(fetch_page(page_number + 1))
+            yield page_number, response, people_ids
+            page_number += 1
+    finally:
+        if next_fetch is not None:
+            next_fetch.cancel()
+
+def expected_result_count(data, page_count, page, per_page, max_results):
+    """Estimate how many people a search will process, for progress reporting."""
+    if not max_results:
+        return page_count
+    total_entries = (data.get("pagination") or {}).get("total_entries")
+    if total_entries is None:
+        return max_results
+    return max(0, min(max_results, total_entries - (page - 1) * per_page))
+
+def person_result(person_data, generated_email_content):
+    """Build a /peoples/ result; a generation exception is reported on this row only."""
+    if isinstance(generated_email_content, asyncio.TimeoutError):
+        error = f"Email generation timed out after {LLM_TIMEOUT:.0f}s"
+    elif isinstance(generated_email_content, Exception):
+        # Retries exhausted (e.g. persistent rate limiting)
+        error = f"Email generation failed: {str(generated_email_content)[:200]}"
+    else:
+        return {
+            "person_data": person_data,
+            "generated_email_content": generated_email_content
+        }
+    return {
+        "person_data": person_data,
+        "generated_email_content": [],
+        "error": error
+    }
+
+def sse_event(data):
+    """Encode a dict as a single Server-Sent Events message."""
+    return ("data: " + json.dumps(data) + "\n\n").encode('utf-8')
+
+async def run_bounded(items, worker, concurrency):
+    """Run `worker` over `items` with at most `concurrency` calls in flight.
+
+    Yields (index, result) pairs in completion order, where index is the
+    item's position in `items`. Items are pulled lazily, so `items` may be
+    a generator (e.g. rows parsed from an upload). Pending work is
+    cancelled if the consumer stops early (e.g. the client disconnects).
+    """
+    iterator = enumerate(items)
+    pending = {}
+
+    def fill():
+        while len(pending) < concurrency:
+            try:
+                index, item = next(iterator)
+            except StopIteration:
+                return
+            pending[asyncio.create_task(worker(item))] = index
+
+    try:
+        fill()
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index = pending.pop(task)
+                yield index, task.result()
+            fill()
+    finally:
+        for task in pending:
+            task.cancel()
+
+def chunked(items, size):
+    """Lazily group `items` into lists of up to `size`."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def run_batched(items, worker, batch_size, concurrency):
+    """Like run_bounded, but `worker` takes a list of up to `batch_size` items
+    and returns one result per item; yields (index, result) per item."""
+    async for batch_index, batch_results in run_bounded(chunked(items, batch_size), worker, concurrency):
+        for position, result in enumerate(batch_results):
+            yield batch_index * batch_size + position, result
+
+async def with_partials(results, partials):
+    """Interleave ("result", item) from `results` with ("partial", event) from the `partials` queue.
+
+    Partials queued before a result are always yielded before it, so a
+    client never sees stale partial text after a prospect has finished.
+    """
+    if partials is None:
+        async for item in results:
+            yield "result", item
+        return
+
+    next_result = asyncio.ensure_future(results.__anext__())
+    next_partial = asyncio.ensure_future(partials.get())
+    try:
+        while True:
+            await asyncio.wait({next_result, next_partial}, return_when=asyncio.FIRST_COMPLETED)
+            if next_partial.done():
+                yield "partial", next_partial.result()
+                next_partial = asyncio.ensure_future(partials.get())
+                continue
+            while not partials.empty():
+                yield "partial", partials.get_nowait()
+            try:
+                item = next_result.result()
+            except StopAsyncIteration:
+                return
+            yield "result", item
+            next_result = asyncio.ensure_future(results.__anext__())
+    finally:
+        # Cancelling the pending __anext__ also runs run_bounded's cleanup
+        next_partial.cancel()
+        next_result.cancel()
+        await asyncio.gather(next_partial, next_result, return_exceptions=True)
 
 @app.get("/person-detail/{person_id}")
-async def fetch_person_data(person_id):
-    url = f"https://api.apollo.io/api/v1/people/match?id={person_id}"
+async def fetch_person_data(person_id, refresh: bool = False):
+    if not refresh:
+        cached = person_cache.get(person_id)
+        if cached is not None:
+            return project_person(cached)
+
+    url = f"{APOLLO_BASE_URL}/people/match?id={person_id}"
     
-    start_time = time.time()
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, headers=HEADERS)
-    elapsed_time = time.time() - start_time
+    with span("apollo.person_match") as match_span, APOLLO_MATCH_SECONDS.time(endpoint="match"):
+        response = await apollo_post(url)
+        match_span.set(status=response.status_code, response_bytes=len(response.content))
     
     if response.status_code == 200:
         data = response.json()
-        person = data.get("person", {})
-        organization = person.get("organization", {})
-        
-        result = {
-            "first_name": person.get("first_name"),
-            "last_name": person.get("last_name"),
-            "title": person.get("title"),
-            "headline": person.get("headline"),
-            "email": person.get("email"),
-            "organization": {
-                "name": organization.get("name"),
-                "city": organization.get("city"),
-                "technology_names": organization.get("technology_names"),
-                "industries": organization.get("industries"),
-                "keywords": organization.get("keywords"),
-                "estimated_num_employees": organization.get("estimated_num_employees"),
-                "website": organization.get("website_url")
-            }
-        }
-        return result
+        person = data.get("person") or {}
+        if person:
+            person_cache.set(person_id, person)
+        return project_person(person)
     elif response.status_code == 401:
         return RedirectResponse(url="/login", status_code=302)
     else:
+        ERRORS_TOTAL.inc(stage="apollo_match")
         return {"error": f"API request failed with status {response.status_code}"}
 
-async def generate_email_content(profile_data, deepseek_prompt,your_name,your_position,your_contact_information):
-    person_name = f"{profile_data['first_name']} {profile_data['last_name']}"
-    my_staff_info = f" ,knowing my name:{your_name}, my position:{your_position}, my contact information:{your_contact_information}"
-    with open("Nobisoft_Company_Overview.txt", "r") as file:
-        company_overview = file.read()
-    my_company_overview = f" and knowing my company overview:{company_overview}"
-    content = (
-        f"Here is the profile data: {profile_data}. The result should only be in JSON format like this:\n"
-        "[\n"
-        "    {\n"
-        "        \"Mail Subject\": \"Hey John, Special Offer!\",\n"
-        "        \"Main Email\": \"Hey John, we have an exclusive discount for Acme Corp!\"\n"
-        "    },\n"
-        "    {\n"
-        "        \"Second Subject\": \"Following up on my last email\",\n"
-        "        \"Second Email\": \"Hey John, just checking if you saw my last email about the Acme Corp discount!\"\n"
-        "    }\n"
-        "]"
-    )
-    
-    start_time = time.time()
-    response = completion(
-        model="deepseek/deepseek-chat",
-        messages=[{"role": "user", "content": INITIAL_DEEPSEEK_PROMPT+my_staff_info+my_company_overview+deepseek_prompt+content}]
+def project_person(person):
+    """Keep only the Apollo person/organization fields used for email generation."""
+    organization = person.get("organization") or {}
+    return {
+        "first_name": person.get("first_name"),
+        "last_name": person.get("last_name"),
+        "title": person.get("title"),
+        "headline": person.get("headline"),
+        "email": person.get("email"),
+        "organization": {
+            "name": organization.get("name"),
+            "city": organization.get("city"),
+            "technology_names": organization.get("technology_names"),
+            "industries": organization.get("industries"),
+            "keywords": organization.get("keywords"),
+            "estimated_num_employees": organization.get("estimated_num_employees"),
+            "website": organization.get("website_url")
+        }
+    }
+
+async def fetch_people_data_bulk(people_ids):
+    """Enrich people with Apollo bulk match, APOLLO_BATCH_SIZE ids per request.
+
+    Returns {person_id: projected person data or None}. Ids the bulk call
+    did not return (or whole batches whose request failed) fall back to
+    single people/match lookups. Matches are written to the person cache;
+    serving cached ids is left to the caller (see BulkPersonFetcher).
+    """
+    results = {}
+    for start in range(0, len(people_ids), APOLLO_BATCH_SIZE):
+        batch = people_ids[start:start + APOLLO_BATCH_SIZE]
+        matches = []
+        try:
+            with span("apollo.bulk_match", ids=len(batch)) as match_span, APOLLO_MATCH_SECONDS.time(endpoint="bulk_match"):
+                response = await apollo_post(
+                    f"{APOLLO_BASE_URL}/people/bulk_match",
+                    json={"details": [{"id": person_id} for person_id in batch]}
+                )
+                match_span.set(status=response.status_code, response_bytes=len(response.content))
+            if response.status_code == 200:
+                matches = response.json().get("matches") or []
+                if not isinstance(matches, list):
+                    raise ValueError(f"'matches' is a {type(matches).__name__}, not a list")
+            else:
+                ERRORS_TOTAL.inc(stage="apollo_match")
+                print(f"Bulk match failed with status {response.status_code}; falling back to single lookups")
+        except httpx.HTTPError as e:
+            ERRORS_TOTAL.inc(stage="apollo_match")
+            print(f"Bulk match request failed: {e}; falling back to single lookups")
+        except (ValueError, AttributeError) as e:
+            # Non-JSON body or unexpected shape: treat like a failed status
+            matches = []
+            ERRORS_TOTAL.inc(stage="apollo_match")
+            print(f"Bulk match returned an unreadable response: {str(e)[:200]}; falling back to single lookups")
+
+        for position, person in enumerate(matches):
+            if not isinstance(person, dict):
+                continue
+            person_id = person.get("id") or (batch[position] if position < len(batch) else None)
+            if person_id in batch:
+                person_cache.set(person_id, person)
+                results[person_id] = project_person(person)
+
+        # Fall back to single lookups for anything the bulk call missed
+        missing = [person_id for person_id in batch if person_id not in results]
+        single_results = await asyncio.gather(*(fetch_person_data(person_id, refresh=True) for person_id in missing), return_exceptions=True)
+        for person_id, person_data in zip(missing, single_results):
+            results[person_id] = person_data if isinstance(person_data, dict) and "error" not in person_data else None
+    return results
+
+class BulkPersonFetcher:
+    """Fetch people on demand in bulk-match batches.
+
+    Cached people are served straight from the person cache (unless
+    `refresh` is set); the rest are split into batches. The first request
+    for an id starts the bulk call for its whole batch and the rest of the
+    batch awaits that same call, so per-person pipelines keep their own
+    pace while Apollo only sees one request per batch.
+    """
+
+    def __init__(self, people_ids, batch_size=APOLLO_BATCH_SIZE, refresh=False):
+        self.cached = {}
+        if not refresh:
+            for person_id in people_ids:
+                person = person_cache.get(person_id)
+                if person is not None:
+                    self.cached[person_id] = project_person(person)
+        self.cache_hits = len(self.cached)
+
+        uncached = [person_id for person_id in people_ids if person_id not in self.cached]
+        self.batches = [uncached[i:i + batch_size] for i in range(0, len(uncached), batch_size)]
+        self.batch_index = {person_id: n for n, batch in enumerate(self.batches) for person_id in batch}
+        self.tasks = {}
+
+    async def get(self, person_id):
+        if person_id in self.cached:
+            return self.cached[person_id]
+        n = self.batch_index[person_id]
+        if n not in self.tasks:
+            self.tasks[n] = asyncio.create_task(fetch_people_data_bulk(self.batches[n]))
+        # Shield so one cancelled consumer does not cancel the batch for the others
+        results = await asyncio.shield(self.tasks[n])
+        return results.get(person_id)
+
+    def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+
+def email_cache_key(model, messages):
+    """Stable hash of the model and normalized prompt messages."""
+    normalized = [
+        {"role": message["role"], "content": " ".join(message["content"].split())}
+        for message in messages
+    ]
+    payload = json.dumps({"model": model, "messages": normalized}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# Output keys per email position, as used by the frontend and the CSV exports
+EMAIL_LABELS = [("Mail Subject", "Main Email"), ("Second Subject", "Second Email")]
+
+def label_emails(emails):
+    """Convert parsed {"subject", "body"} emails to the labelled keys of EMAIL_LABELS."""
+    return [
+        {subject_label: email["subject"], body_label: email["body"]}
+        for (subject_label, body_label), email in zip(EMAIL_LABELS, emails)
+    ]
+
+def acompletion(*args, **kwargs):
+    """litellm.acompletion, imported on first use: litellm takes seconds to import."""
+    from litellm import acompletion as litellm_acompletion
+    return litellm_acompletion(*args, **kwargs)
+
+async def complete_text(messages):
+    """Run one completion with retries and return its text. The caller holds llm_semaphore."""
+    response = await acall_with_retries(
+        lambda: asyncio.wait_for(
+            acompletion(
+                model=LLM_MODEL,
+                messages=messages,
+                api_base=LLM_API_BASE,
+                timeout=LLM_TIMEOUT
+            ),
+            timeout=LLM_TIMEOUT
+        ),
+        limiter=llm_limiter,
+        max_retries=LLM_MAX_RETRIES,
+        on_retry=count_retry("llm")
     )
-    content_text = response["choices"][0]["message"]["content"].replace("'","'")
-    
-    # Try to find JSON content between ```json and ``` markers
-    if "```json" in content_text:
-        json_content = content_text.split("```json")[-1].split("```")[0].strip()
-    # If not found, try to extract just the JSON part
-    else:
-        # Find first [ and last ]
-        start_idx = content_text.find("[")
-        end_idx = content_text.rfind("]") + 1
-        if start_idx >= 0 and end_idx > start_idx:
-            json_content = content_text[start_idx:end_idx]
-        else:
-            json_content = content_text
-    
-    parsed_content = json.loads(json_content)
-    elapsed_time = time.time() - start_time
+    return response["choices"][0]["message"]["content"] or ""
+
+async def stream_email_completion(messages, on_partial):
+    """Run a streamed completion, reporting partial subject/body text; returns the full text.
+
+    `on_partial(email, field, text)` gets the text of a field so far at most
+    every LLM_STREAM_INTERVAL seconds, and once more when the field completes.
+    """
+    parser = EmailStreamParser()
+    parts = []
+    last_sent = 0.0
+    stream = await acompletion(model=LLM_MODEL, messages=messages, api_base=LLM_API_BASE, timeout=LLM_TIMEOUT, stream=True)
+    async for chunk in stream:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if not delta:
+            continue
+        parts.append(delta)
+        for email, field, text in parser.feed(delta):
+            on_partial(email, field, text)
+        current = parser.partial()
+        now = time.monotonic()
+        if current and current[2] and now - last_sent >= LLM_STREAM_INTERVAL:
+            on_partial(*current)
+            last_sent = now
+    return "".join(parts)
+
+async def generate_email_content(profile_data, deepseek_prompt,your_name,your_position,your_contact_information, use_cache: bool = True, on_partial=None):
+    with span("prompt.build") as prompt_span:
+        messages = prompt_builder.build_messages(
+            profile_data,
+            deepseek_prompt,
+            sender={"name": your_name, "position": your_position, "contact": your_contact_information}
+        )
+        prompt_span.set(prompt_chars=sum(len(message["content"]) for message in messages))
+
+    # Identical prompts reuse the stored parsed result
+    cache_key = email_cache_key(LLM_MODEL, messages)
+    if use_cache:
+        with span("email_cache") as cache_span:
+            cached = email_cache.get(cache_key)
+            cache_span.set(cache_hit=cached is not None)
+        if cached is not None:
+            return cached
 
+    # Async completion keeps the event loop free; wait_for enforces the timeout
+    # and cancels the call if the client goes away
+    async with llm_semaphore:
+        mode = "stream" if on_partial is not None else "single"
+        with span("llm.call", model=LLM_MODEL, mode=mode) as llm_span:
+            try:
+                with LLM_GENERATION_SECONDS.time(mode=mode):
+                    if on_partial is not None:
+                        # Streamed: partial subject/body text is reported while tokens arrive
+                        content_text = await acall_with_retries(
+                            lambda: asyncio.wait_for(stream_email_completion(messages, on_partial), timeout=LLM_TIMEOUT),
+                            limiter=llm_limiter,
+                            max_retries=LLM_MAX_RETRIES,
+                            on_retry=count_retry("llm")
+                        )
+                    else:
+                        content_text = await complete_text(messages)
+            except Exception:
+                ERRORS_TOTAL.inc(stage="llm")
+                raise
+            llm_span.set(response_chars=len(content_text))
+    with span("parse") as parse_span, EMAIL_PARSE_SECONDS.time():
+        parsed_content = label_emails(parse_emails(content_text))
+        parse_span.set(emails=len(parsed_content))
+    if not parsed_content:
+        ERRORS_TOTAL.inc(stage="parse")
+        print(f"Could not parse generated email content: {content_text[:200]!r}")
+
+    if parsed_content:
+        email_cache.set(cache_key, parsed_content)
     return parsed_content
 
+async def generate_email_batch(profiles, deepseek_prompt, your_name, your_position, your_contact_information, use_cache: bool = True):
+    """Generate emails for several prospects with a single completion call.
+
+    Returns one entry per profile, in order: the labelled email list, or the
+    exception that made generation fail. Cached prospects are served from
+    the email cache under their single-prospect key, and prospects missing
+    or incomplete in the batched response are retried with individual calls.
+    """
+    sender = {"name": your_name, "position": your_position, "contact": your_contact_information}
+    cache_keys = [email_cache_key(LLM_MODEL, prompt_builder.build_messages(profile, deepseek_prompt, sender=sender)) for profile in profiles]
+    results = [email_cache.get(key) if use_cache else None for key in cache_keys]
+    pending = [index for index, result in enumerate(results) if result is None]
+
+    if len(pending) > 1:
+        prospects = {f"P{number}": index for number, index in enumerate(pending, 1)}
+        messages = prompt_builder.build_batch_messages(
+            {prospect_id: profiles[index] for prospect_id, index in prospects.items()},
+            deepseek_prompt,
+            sender=sender
+        )
+        try:
+            async with llm_semaphore:
+                with span("llm.call", model=LLM_MODEL, mode="batch", prospects=len(prospects)) as llm_span, LLM_GENERATION_SECONDS.time(mode="batch"):
+                    llm_span.set(prompt_chars=sum(len(message["content"]) for message in messages))
+                    content_text = await complete_text(messages)
+                    llm_span.set(response_chars=len(content_text))
+            with span("parse", prospects=len(prospects)) as parse_span, EMAIL_PARSE_SECONDS.time():
+                batch = parse_batched_emails(content_text, list(prospects))
+                parse_span.set(emails=sum(len(emails) for emails in batch.values()))
+        except Exception as e:
+            # Everyone in the batch is retried individually below
+            ERRORS_TOTAL.inc(stage="llm")
+            print(f"Batched email generation failed for {len(prospects)} prospects: {str(e)[:200]}")
+            batch = {}
+        for prospect_id, index in prospects.items():
+            emails = label_emails(batch.get(prospect_id, []))
+            if emails:
+                results[index] = emails
+                email_cache.set(cache_keys[index], emails)
+
+    missing = [index for index in pending if results[index] is None]
+    retried = await asyncio.gather(
+        *(generate_email_content(profiles[index], deepseek_prompt, your_name, your_position, your_contact_information, use_cache=False) for index in missing),
+        return_exceptions=True
+    )
+    for index, result in zip(missing, retried):
+        results[index] = result
+    return results
+
+SEARCH_EXPORT_COLUMNS = [
+    "EMAIL", "Website", "First Name", "Last Name", "Title", "Company",
+    "Mail Subject", "Main Email", "Second Subject", "Second Email"
+]
+
+def search_result_csv_row(result):
+    """Map a /peoples/ result to a row of SEARCH_EXPORT_COLUMNS."""
+    person_data = result.get("person_data") or {}
+    email_content = result.get("generated_email_content") or []
+
+    first_email = email_content[0] if len(email_content) > 0 else {}
+    second_email = email_content[1] if len(email_content) > 1 else {}
+
+    organization = person_data.get("organization") or {}
+
+    return [
+        person_data.get("email", ""),
+        organization.get("website", ""),
+        person_data.get("first_name", ""),
+        person_data.get("last_name", ""),
+        person_data.get("title", ""),
+        organization.get("name", ""),
+        first_email.get("Mail Subject", ""),
+        first_email.get("Main Email", ""),
+        second_email.get("Second Subject", ""),
+        second_email.get("Second Email", "")
+    ]
+
+def export_response(columns, rows, filename, fmt="csv", compress=False):
+    """Stream `rows` as a CSV or JSONL download; `filename` gets the format's extension."""
+    try:
+        chunks, media_type, extension, headers = export_stream(columns, rows, fmt, compress)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail={"error": True, "message": str(e), "type": "invalid_format"})
+    return StreamingResponse(
+        timed_iter(chunks, CSV_IO_SECONDS, op="write"),
+        media_type=media_type,
+        headers={**headers, "Content-Disposition": f"attachment; filename={filename}.{extension}"}
+    )
+
+def get_run_or_404(run_id, current_user):
+    run = result_store.get_run(run_id)
+    owner = current_user.get("username") if isinstance(current_user, dict) else None
+    if run is None or (run["owner"] and run["owner"] != owner):
+        raise HTTPException(status_code=404, detail={"error": True, "message": "Run not found", "type": "run_not_found"})
+    return run
+
+def run_summary(run):
+    return {key: value for key, value in run.items() if key != "owner"}
+
+def export_run(run, fmt="csv", compress=False):
+    """Stream a stored run: search runs use SEARCH_EXPORT_COLUMNS, CSV runs their own columns."""
+    results = result_store.iter_results(run["id"])
+    if run["kind"] == "csv":
+        columns = run["columns"]
+        rows = ([row.get(column, "") for column in columns] for row in results)
+        filename = f"processed_results_{time.strftime('%Y-%m-%d')}"
+    else:
+        columns = SEARCH_EXPORT_COLUMNS
+        rows = (search_result_csv_row(result) for result in results)
+        filename = f"result_{time.strftime('%Y-%m-%d')}"
+    return export_response(columns, rows, filename, fmt, compress)
+
 @app.post("/export-csv/")
 async def export_csv(request: Request, current_user: dict = Depends(get_current_user)):
-    """Export search results to CSV without calling the API again."""
-    # The frontend will send the current results as JSON in the request body
+    """Export search results without calling the API again.
+
+    Send {"run_id": ...} to export a stored run; a full {"results": [...]}
+    body is still accepted for older clients. Optional "format" ("csv" or
+    "jsonl") and "gzip" select the output encoding.
+    """
     data = await request.json()
+    fmt = data.get("format", "csv")
+    compress = bool(data.get("gzip"))
+    if data.get("run_id"):
+        return export_run(get_run_or_404(data["run_id"], current_user), fmt, compress)
+
     results = data.get("results", [])
-    
-    # Create a StringIO object to write CSV data
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header row
-    writer.writerow([
-        "EMAIL", "Website", "First Name", "Last Name", "Title", "Company",
-        "Mail Subject", "Main Email", "Second Subject", "Second Email"
-    ])
-    
-    # Write data rows
-    for result in results:
-        person_data = result.get("person_data", {})
-        email_content = result.get("generated_email_content", [])
-        
-        first_email = email_content[0] if len(email_content) > 0 else {}
-        second_email = email_content[1] if len(email_content) > 1 else {}
-        
-        organization = person_data.get("organization", {})
-        
-        writer.writerow([
-            person_data.get("email", ""),
-            organization.get("website", ""),
-            person_data.get("first_name", ""),
-            person_data.get("last_name", ""),
-            person_data.get("title", ""),
-            organization.get("name", ""),
-            first_email.get("Mail Subject", ""),
-            first_email.get("Main Email", ""),
-            second_email.get("Second Subject", ""),
-            second_email.get("Second Email", "")
-        ])
-    
-    # Reset the pointer to the beginning of the StringIO object
-    output.seek(0)
-    
-    # Return the CSV file as a streaming response
     current_date = time.strftime("%Y-%m-%d")
-    filename = f"result_{current_date}.csv"
-    return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    rows = (search_result_csv_row(result) for result in results)
+    return export_response(SEARCH_EXPORT_COLUMNS, rows, f"result_{current_date}", fmt, compress)
+
+@app.get("/runs/{run_id}")
+async def get_run_status(run_id: str, current_user: dict = Depends(get_current_user)):
+    return run_summary(get_run_or_404(run_id, current_user))
+
+@app.get("/runs/{run_id}/results")
+async def get_run_results(
+    run_id: str,
+    offset: int = Query(0, ge=0, description="Number of results to skip"),
+    limit: int = Query(50, ge=1, le=500, description="Maximum number of results to return"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Page through a stored run's results in search/row order."""
+    run = get_run_or_404(run_id, current_user)
+    return {
+        **run_summary(run),
+        "offset": offset,
+        "results": list(result_store.iter_results(run_id, offset=offset, limit=limit))
+    }
+
+@app.get("/runs/{run_id}/export")
+async def export_run_csv(
+    run_id: str,
+    fmt: str = Query("csv", alias="format", description="csv or jsonl"),
+    gzip: bool = Query(False, description="Gzip content-encode the download"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Download a stored run (also works while the run is still in progress)."""
+    return export_run(get_run_or_404(run_id, current_user), fmt, gzip)
+
+CSV_REQUIRED_COLUMNS = [
+    "First Name", "Last Name", "Title", "Company", "Email", "Seniority",
+    "Departments", "# Employees", "Industry", "Keywords", "City", "State",
+    "Country", "Company City", "Company State", "Company Country", "Technologies"
+]
+CSV_EMAIL_COLUMNS = ["Mail Subject", "Main Email", "Second Subject", "Second Email"]
+
+def csv_row_to_profile(row):
+    """Build the profile passed to email generation from an uploaded CSV row."""
+    return {
+        "first_name": row.get("First Name", ""),
+        "last_name": row.get("Last Name", ""),
+        "title": row.get("Title", ""),
+        "email": row.get("Email", ""),
+        "organization": {
+            "name": row.get("Company", ""),
+            "city": row.get("Company City", ""),
+            "estimated_num_employees": row.get("# Employees", ""),
+            "website_url": row.get("Technologies", ""),
+            "industries": [row.get("Industry", "")] if row.get("Industry") else [],
+            "keywords": row.get("Keywords", "").split(", ") if row.get("Keywords") else [],
+            "technology_names": row.get("Technologies", "").split(", ") if row.get("Technologies") else []
+        }
+    }
+
+def add_email_columns(row, email_content):
+    """Return a copy of `row` with the generated email columns filled in."""
+    first_email = email_content[0] if len(email_content) > 0 else {}
+    second_email = email_content[1] if len(email_content) > 1 else {}
+
+    row_with_email = row.copy()
+    row_with_email["Mail Subject"] = first_email.get("Mail Subject", "")
+    row_with_email["Main Email"] = first_email.get("Main Email", "")
+    row_with_email["Second Subject"] = second_email.get("Second Subject", "")
+    row_with_email["Second Email"] = second_email.get("Second Email", "")
+    return row_with_email
+
+async def process_csv_row(row, deepseek_prompt, your_name, your_position, your_contact, use_email_cache=True):
+    """Generate emails for one uploaded CSV row; returns None for rows missing required values."""
+    if not all(row.get(col) for col in CSV_REQUIRED_COLUMNS):
+        return None  # Skip invalid rows
+    try:
+        with span("row", email=row.get("Email", "")):
+            email_content = await generate_email_content(csv_row_to_profile(row), deepseek_prompt, your_name, your_position, your_contact, use_cache=use_email_cache)
+    except Exception as e:
+        # Timeouts or retries exhausted: keep the row with empty emails rather than failing the upload
+        print(f"Email generation failed for {row.get('Email', '')}: {str(e)[:200]}")
+        email_content = []
+    if email_content:
+        contacted_index.add(email=row.get("Email"))
+    return add_email_columns(row, email_content)
+
+async def process_csv_rows(rows, deepseek_prompt, your_name, your_position, your_contact, use_email_cache=True):
+    """Batched process_csv_row: one completion call for the valid rows in `rows`; returns one output per row."""
+    valid = [index for index, row in enumerate(rows) if all(row.get(col) for col in CSV_REQUIRED_COLUMNS)]
+    with span("rows", count=len(valid)):
+        generated = await generate_email_batch(
+            [csv_row_to_profile(rows[index]) for index in valid],
+            deepseek_prompt, your_name, your_position, your_contact, use_cache=use_email_cache
+        )
+    outputs = [None] * len(rows)
+    for index, email_content in zip(valid, generated):
+        if isinstance(email_content, Exception):
+            print(f"Email generation failed for {rows[index].get('Email', '')}: {str(email_content)[:200]}")
+            email_content = []
+        if email_content:
+            contacted_index.add(email=rows[index].get("Email"))
+        outputs[index] = add_email_columns(rows[index], email_content)
+    return outputs
 
 @app.post("/process-csv/")
 async def process_csv(
@@ -451,6 +1252,13 @@ async def process_csv(
     your_name: str = Form("", description="Your name"),
     your_position: str = Form("", description="Your position"),
     your_contact: str = Form("", description="Your contact information"),
+    use_email_cache: bool = Form(True, description="Reuse previously generated emails for identical prompts"),
+    stream: bool = Form(False, description="Stream per-row progress and finished rows as Server-Sent Events"),
+    concurrency: int = Form(MAX_CONCURRENCY, ge=1, le=50, description="Number of rows processed in parallel"),
+    batch_size: int = Form(LLM_BATCH_SIZE, ge=1, le=10, description="Rows per email generation call"),
+    skip_contacted: bool = Form(SKIP_CONTACTED, description="Skip rows whose email already got generated emails"),
+    trace: bool = Form(False, description="Record a trace of this upload in TRACE_PATH"),
+    profile: bool = Form(False, description="Also sample the event loop's stacks into PROFILE_DIR (implies trace)"),
     file: UploadFile = File(...)
 ):
     """Process CSV file with error handling and stream progress updates."""
@@ -463,111 +1271,157 @@ async def process_csv(
                 "type": "file_type_error"
             }
         )
-    temp_file_path = f"temp_{int(time.time())}.csv"
 
-    try:
-        # Save the uploaded file
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        results = []
-        with open(temp_file_path, "r", encoding="utf-8-sig") as csvfile:
-            reader = csv.DictReader(csvfile)
+    # Rows are parsed straight from the upload as they are needed; a streamed
+    # response gets its own spooled copy since it outlives this handler
+    upload = file.file
+    if stream:
+        upload = tempfile.SpooledTemporaryFile(max_size=10 * 1024 * 1024)
+        shutil.copyfileobj(file.file, upload)
+        upload.seek(0)
+    upload_size = upload.seek(0, os.SEEK_END) or 1
+    upload.seek(0)
+    csvfile = io.TextIOWrapper(upload, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(csvfile)
+    rows = timed_iter(reader, CSV_IO_SECONDS, op="read")
 
-            required_columns = [
-                "First Name", "Last Name", "Title", "Company", "Email", "Seniority",
-                "Departments", "# Employees", "Industry", "Keywords", "City", "State",
-                "Country", "Company City", "Company State", "Company Country", "Technologies"
-            ]
+    missing_columns = [col for col in CSV_REQUIRED_COLUMNS if col not in (reader.fieldnames or [])]
+    if missing_columns:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "error": True,
+                "message": f"Missing required columns: {', '.join(missing_columns)}",
+                "type": "missing_columns",
+                "missing_columns": missing_columns
+            }
+        )
 
-            missing_columns = [col for col in required_columns if col not in reader.fieldnames]
-            if missing_columns:
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "error": True,
-                        "message": f"Missing required columns: {', '.join(missing_columns)}",
-                        "type": "missing_columns",
-                        "missing_columns": missing_columns
-                    }
-                )
+    skipped = 0
 
-            total_rows = sum(1 for _ in open(temp_file_path)) - 1  # Count rows (excluding header)
-            processed = 0
+    def already_contacted(row):
+        nonlocal skipped
+        if skip_contacted and contacted_index.contains(email=row.get("Email")):
+            skipped += 1
+            return True
+        return False
 
-            csvfile.seek(0)
-            next(reader)  # Skip header row
-
-            for row in reader:
-                processed += 1
-                
-                if not all(row.get(col) for col in required_columns):
-                    continue  # Skip invalid rows
-                
-                profile_data = {
-                    "first_name": row.get("First Name", ""),
-                    "last_name": row.get("Last Name", ""),
-                    "title": row.get("Title", ""),
-                    "email": row.get("Email", ""),
-                    "organization": {
-                        "name": row.get("Company", ""),
-                        "city": row.get("Company City", ""),
-                        "estimated_num_employees": row.get("# Employees", ""),
-                        "website_url": row.get("Technologies", ""),
-                        "industries": [row.get("Industry", "")] if row.get("Industry") else [],
-                        "keywords": row.get("Keywords", "").split(", ") if row.get("Keywords") else [],
-                        "technology_names": row.get("Technologies", "").split(", ") if row.get("Technologies") else []
-                    }
-                }
-                
-                # Simulate generating email content
-                email_content = await generate_email_content(profile_data, deepseek_prompt, your_name, your_position, your_contact)
+    async def process_row(row):
+        if already_contacted(row):
+            return None
+        return await process_csv_row(row, deepseek_prompt, your_name, your_position, your_contact, use_email_cache)
+
+    async def process_rows(rows):
+        contacted = [already_contacted(row) for row in rows]
+        fresh = [row for row, known in zip(rows, contacted) if not known]
+        outputs = iter(await process_csv_rows(fresh, deepseek_prompt, your_name, your_position, your_contact, use_email_cache))
+        return [None if known else next(outputs) for known in contacted]
+
+    trace_id = new_trace_id() if trace or profile else None
+
+    def process_all():
+        if batch_size > 1:
+            outcomes = run_batched(rows, process_rows, batch_size, concurrency)
+        else:
+            outcomes = run_bounded(rows, process_row, concurrency)
+        return traced(outcomes, "csv", trace_id, profile, filename=file.filename, batch_size=batch_size, concurrency=concurrency)
 
-                first_email = email_content[0] if len(email_content) > 0 else {}
-                second_email = email_content[1] if len(email_content) > 1 else {}
+    fieldnames = list(reader.fieldnames) + [col for col in CSV_EMAIL_COLUMNS if col not in reader.fieldnames]
+    filename = f"processed_results_{time.strftime('%Y-%m-%d')}.csv"
+    # Output rows are stored under run_id by row index, for export without re-uploading
+    run_id = result_store.create_run("csv", owner=current_user.get("username") if isinstance(current_user, dict) else None, columns=fieldnames)
 
-                row_with_email = row.copy()
-                row_with_email["Mail Subject"] = first_email.get("Mail Subject", "")
-                row_with_email["Main Email"] = first_email.get("Main Email", "")
-                row_with_email["Second Subject"] = second_email.get("Second Subject", "")
-                row_with_email["Second Email"] = second_email.get("Second Email", "")
+    if stream:
+        async def generate():
+            processed = 0
+            succeeded = 0
+            run_status = "incomplete"
+            try:
+                yield sse_event({"success": True, "in_progress": True, "progress": 0, "processed": 0, "columns": fieldnames, "run_id": run_id})
+                async for index, row in process_all():
+                    processed += 1
+                    if row:
+                        succeeded += 1
+                        result_store.add_result(run_id, index, row)
+                    yield sse_event({
+                        "success": True,
+                        "in_progress": True,
+                        "progress": min(upload.tell() / upload_size * 100, 99),
+                        "processed": processed,
+                        "skipped": skipped,
+                        "row_index": index,
+                        "row": row
+                    })
+                yield sse_event({
+                    "success": succeeded > 0,
+                    "in_progress": False,
+                    "progress": 100,
+                    "total_rows": processed,
+                    "processed": processed,
+                    "succeeded": succeeded,
+                    "skipped": skipped,
+                    "status": "complete",
+                    "filename": filename,
+                    "run_id": run_id,
+                    **({"trace_id": trace_id} if trace_id else {}),
+                    **({} if succeeded else {"error": "No valid rows could be processed from the CSV", "type": "no_valid_rows"})
+                })
+                run_status = "completed"
+            except Exception as e:
+                run_status = "failed"
+                yield sse_event({
+                    "error": True,
+                    "message": f"Unexpected error processing CSV: {str(e)}",
+                    "type": "unexpected_error"
+                })
+            finally:
+                # Closing the wrapper closes the spooled upload; referencing it here also keeps
+                # it from being collected (and closing the upload) once the reader is exhausted
+                csvfile.close()
+                result_store.finish_run(run_id, run_status)
 
-                results.append(row_with_email)
+        return StreamingResponse(generate(), media_type="text/event-stream")
 
-        if not results:
+    try:
+        # Rows go straight to the result store; the response links to the streamed export
+        processed = 0
+        succeeded = 0
+        async for index, row in process_all():
+            processed += 1
+            if row:
+                succeeded += 1
+                result_store.add_result(run_id, index, row)
+        result_store.finish_run(run_id)
+
+        if not succeeded:
             return JSONResponse(
                 status_code=400,
                 content={
                     "error": True,
                     "message": "No valid rows could be processed from the CSV",
-                    "type": "no_valid_rows"
+                    "type": "no_valid_rows",
+                    "skipped": skipped
                 }
             )
 
-        # Generate output CSV file
-        output = io.StringIO()
-        fieldnames = list(results[0].keys()) if results else []
-        writer = csv.DictWriter(output, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(results)
-        output.seek(0)
-
-        os.remove(temp_file_path)  # Clean up temp file
         return JSONResponse(
             status_code=200,
             content={
                 "success": True,
-                "total_rows": total_rows,
+                "total_rows": processed,
                 "processed": processed,
+                "succeeded": succeeded,
+                "skipped": skipped,
                 "status": "complete",
-                "csv_content": output.getvalue(),
-                "filename": f"processed_results_{time.strftime('%Y-%m-%d')}.csv"
+                "filename": filename,
+                "run_id": run_id,
+                "download_url": f"/runs/{run_id}/export",
+                **({"trace_id": trace_id} if trace_id else {})
             }
         )
 
     except Exception as e:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        result_store.finish_run(run_id, "failed")
         raise HTTPException(
             status_code=500,
             detail={
@@ -575,4 +1429,142 @@ async def process_csv(
                 "message": f"Unexpected error processing CSV: {str(e)}",
                 "type": "unexpected_error"
             }
-        )
\ No newline at end of file
+        )
+
+async def process_job_row(params, row):
+    if params.get("skip_contacted", SKIP_CONTACTED) and contacted_index.contains(email=row.get("Email")):
+        return None  # Counted as a skipped row
+    return await process_csv_row(
+        row,
+        params.get("deepseek_prompt", ""),
+        params.get("your_name", ""),
+        params.get("your_position", ""),
+        params.get("your_contact", ""),
+        params.get("use_email_cache", True)
+    )
+
+def require_user(current_user):
+    """Return the username, or 401 when get_current_user handed back a login redirect instead of a user."""
+    if not isinstance(current_user, dict):
+        raise HTTPException(
+            status_code=401,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return current_user.get("username")
+
+def get_job_or_404(job_id, current_user):
+    owner = require_user(current_user)
+    job = job_store.get_job(job_id)
+    if job is None or job["owner"] != owner:
+        raise HTTPException(status_code=404, detail={"error": True, "message": "Job not found", "type": "job_not_found"})
+    return job
+
+def job_summary(job):
+    return {key: value for key, value in job.items() if key != "params"}
+
+@app.post("/jobs/csv")
+async def submit_csv_job(
+    current_user: dict = Depends(get_current_user),
+    deepseek_prompt: str = Form("", description="Deepseek prompt"),
+    your_name: str = Form("", description="Your name"),
+    your_position: str = Form("", description="Your position"),
+    your_contact: str = Form("", description="Your contact information"),
+    use_email_cache: bool = Form(True, description="Reuse previously generated emails for identical prompts"),
+    skip_contacted: bool = Form(SKIP_CONTACTED, description="Skip rows whose email already got generated emails"),
+    file: UploadFile = File(...)
+):
+    """Queue a CSV for background processing and return its job id immediately."""
+    owner = require_user(current_user)
+    if not file.filename.lower().endswith('.csv'):
+        return JSONResponse(
+            status_code=400,
+            content={
+                "error": True,
+                "message": "Uploaded file must be a CSV file",
+                "type": "file_type_error"
+            }
+        )
+
+    reader = csv.DictReader(io.TextIOWrapper(file.file, encoding="utf-8-sig", newline=""))
+    missing_columns = [col for col in CSV_REQUIRED_COLUMNS if col not in (reader.fieldnames or [])]
+    if missing_columns:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "error": True,
+                "message": f"Missing required columns: {', '.join(missing_columns)}",
+                "type": "missing_columns",
+                "missing_columns": missing_columns
+            }
+        )
+
+    fieldnames = list(reader.fieldnames) + [col for col in CSV_EMAIL_COLUMNS if col not in reader.fieldnames]
+    job_id = job_store.create_job(
+        list(reader),
+        fieldnames,
+        {
+            "deepseek_prompt": deepseek_prompt,
+            "your_name": your_name,
+            "your_position": your_position,
+            "your_contact": your_contact,
+            "use_email_cache": use_email_cache,
+            "skip_contacted": skip_contacted
+        },
+        owner=owner,
+        filename=f"processed_results_{time.strftime('%Y-%m-%d')}.csv"
+    )
+    app.state.job_runner.submit(job_id)
+    return JSONResponse(status_code=202, content={"success": True, "job_id": job_id, "status": "queued"})
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, current_user: dict = Depends(get_current_user)):
+    return job_summary(get_job_or_404(job_id, current_user))
+
+@app.get("/jobs/{job_id}/events", response_class=StreamingResponse)
+async def stream_job_events(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Stream job progress as Server-Sent Events until the job stops."""
+    get_job_or_404(job_id, current_user)
+
+    async def generate():
+        last = None
+        while True:
+            job = job_store.get_job(job_id)
+            summary = job_summary(job)
+            if summary != last:
+                yield sse_event({**summary, "in_progress": job["status"] in ("queued", "running")})
+                last = summary
+            if job["status"] not in ("queued", "running"):
+                return
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    get_job_or_404(job_id, current_user)
+    cancelled = app.state.job_runner.cancel(job_id)
+    return job_summary({**job_store.get_job(job_id), "cancelled": cancelled})
+
+@app.get("/jobs/{job_id}/download")
+async def download_job(
+    job_id: str,
+    fmt: str = Query("csv", alias="format", description="csv or jsonl"),
+    gzip: bool = Query(False, description="Gzip content-encode the download"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Download the rows processed so far (partial while the job runs, final once complete)."""
+    job = get_job_or_404(job_id, current_user)
+    columns = job["columns"]
+    rows = ([row.get(column, "") for column in columns] for row in job_store.completed_outputs(job_id))
+    filename = os.path.splitext(job["filename"])[0]
+    if job["status"] != "completed":
+        filename = f"partial_{filename}"
+    return export_response(columns, rows, filename, fmt, gzip)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Per-stage latency histograms and error/retry/cache counters in Prometheus text format."""
+    record_cache_stats("person", person_cache)
+    record_cache_stats("email", email_cache)
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
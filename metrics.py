@@ -0,0 +1,203 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds: upstream calls range from fast cached lookups to slow completions
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Local work (parsing, CSV reads/writes) is usually well under a millisecond per call
+FAST_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label set."""
+
+    type = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """Mirror a count kept elsewhere (e.g. SQLiteCache hits) before rendering."""
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, key, value
+
+    def summary(self):
+        for _, key, value in self.samples():
+            if value:
+                yield f"{self.name}{_format_labels(key)}: {value}"
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram per label set, in seconds."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the block, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _snapshot(self):
+        with self._lock:
+            return sorted((key, list(counts), total, count) for key, (counts, total, count) in self._series.items())
+
+    def samples(self):
+        for key, counts, total, count in self._snapshot():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", key + (("le", _format_value(float(bound))),), cumulative
+            yield f"{self.name}_sum", key, total
+            yield f"{self.name}_count", key, count
+
+    def quantile(self, counts, count, q):
+        """Upper bound of the bucket holding the q-quantile (an estimate, like Prometheus' own)."""
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            if cumulative >= q * count:
+                return bound
+        return float("inf")
+
+    def summary(self):
+        for key, counts, total, count in self._snapshot():
+            if not count:
+                continue
+            p50, p95 = (self._describe_bound(self.quantile(counts, count, q)) for q in (0.5, 0.95))
+            yield (
+                f"{self.name}{_format_labels(key)}: {count} calls, {total:.2f}s total, "
+                f"avg {total / count:.3f}s, p50 {p50}, p95 {p95}"
+            )
+
+    def _describe_bound(self, bound):
+        return f"> {self.buckets[-1]:g}s" if bound == float("inf") else f"<= {bound:g}s"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help):
+        metric = Counter(name, help)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, key, value in metric.samples():
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def summary_lines(self):
+        """One human-readable line per non-empty series, for end-of-run logs."""
+        return [line for metric in self._metrics for line in metric.summary()]
+
+
+def timed_iter(iterable, histogram, **labels):
+    """Yield from `iterable`, observing the total time spent producing items once it ends."""
+    iterator = iter(iterable)
+    spent = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                spent += time.perf_counter() - start
+                return
+            spent += time.perf_counter() - start
+            yield item
+    finally:
+        histogram.observe(spent, **labels)
+
+
+# Shared by the web app and the CLI
+REGISTRY = MetricsRegistry()
+APOLLO_SEARCH_SECONDS = REGISTRY.histogram("apollo_search_seconds", "Apollo mixed_people/search latency per page, including retries")
+APOLLO_MATCH_SECONDS = REGISTRY.histogram("apollo_match_seconds", "Apollo people/match and people/bulk_match latency, including retries")
+LLM_GENERATION_SECONDS = REGISTRY.histogram("llm_generation_seconds", "Email generation completion latency, including retries")
+EMAIL_PARSE_SECONDS = REGISTRY.histogram("email_parse_seconds", "Time to parse generated text into emails", FAST_BUCKETS)
+CSV_IO_SECONDS = REGISTRY.histogram("csv_io_seconds", "Time spent reading and writing CSV data", FAST_BUCKETS)
+ERRORS_TOTAL = REGISTRY.counter("errors_total", "Failed upstream calls and unparseable generations, by stage")
+RETRIES_TOTAL = REGISTRY.counter("retries_total", "Retried upstream requests, by upstream")
+CACHE_HITS_TOTAL = REGISTRY.counter("cache_hits_total", "Cache lookups served from the cache")
+CACHE_MISSES_TOTAL = REGISTRY.counter("cache_misses_total", "Cache lookups that missed or had expired")
+
+
+def count_retry(upstream):
+    """on_retry callback for call_with_retries/acall_with_retries that counts the retry."""
+    def on_retry(attempt, response, exc):
+        RETRIES_TOTAL.inc(upstream=upstream)
+    return on_retry
+
+
+def record_cache_stats(name, cache):
+    """Mirror a SQLiteCache's hit/miss counters into the cache metrics."""
+    CACHE_HITS_TOTAL.set(cache.hits, cache=name)
+    CACHE_MISSES_TOTAL.set(cache.misses, cache=name)
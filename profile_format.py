@@ -0,0 +1,121 @@
+import re
+
+# Roughly how many characters one token covers for English text and JSON-ish data
+CHARS_PER_TOKEN = 4
+
+# Fields in the order they matter for personalising an email; anything else follows
+FIELD_PRIORITY = [
+    "first_name", "last_name", "title", "headline", "seniority",
+    "organization.name", "organization.industries", "organization.estimated_num_employees",
+    "organization.city", "organization.website", "organization.keywords",
+    "organization.technology_names", "email"
+]
+# Lists are never cut below this many items before lower-priority fields are dropped
+MIN_LIST_ITEMS = 3
+
+
+def estimate_tokens(text):
+    """Cheap token estimate: about one token per CHARS_PER_TOKEN characters, and at least one per word."""
+    if not text:
+        return 0
+    return max(len(re.findall(r"\w+", text)), round(len(text) / CHARS_PER_TOKEN))
+
+
+def estimate_message_tokens(messages):
+    """Estimate the prompt tokens of chat messages, including a small per-message overhead."""
+    return sum(estimate_tokens(message.get("content") or "") + 4 for message in messages)
+
+
+def _flatten(data, prefix=""):
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{name}.")
+        else:
+            yield name, value
+
+
+def _normalize(profile):
+    """Lift the CLI's nested {"person": {...}, "organization": {...}} shape to the flat web app shape."""
+    person = profile.get("person")
+    if not isinstance(person, dict):
+        return profile
+    normalized = {key: value for key, value in profile.items() if key != "person"}
+    for key, value in person.items():
+        normalized.setdefault(key, value)
+    return normalized
+
+
+def _priority(name):
+    """Position in FIELD_PRIORITY, by full name and then by leaf key ("x.title" ranks as "title")."""
+    for candidate in (name, name.rpartition(".")[2]):
+        if candidate in FIELD_PRIORITY:
+            return FIELD_PRIORITY.index(candidate)
+    return len(FIELD_PRIORITY)
+
+
+def _is_empty(value):
+    return value is None or (isinstance(value, (str, list, tuple, dict)) and not value)
+
+
+def rank_items(items, context=""):
+    """Deduplicate list items, moving the ones that share a word with `context` to the front."""
+    context_words = set(re.findall(r"\w+", context.lower()))
+    unique = []
+    seen = set()
+    for item in items:
+        text = str(item).strip()
+        if text and text.lower() not in seen:
+            seen.add(text.lower())
+            unique.append(text)
+    # Stable sort keeps the upstream (relevance) order within each group
+    return sorted(unique, key=lambda text: not (set(re.findall(r"\w+", text.lower())) & context_words))
+
+
+def format_profile(profile, token_budget=0):
+    """Serialize a prospect profile as compact `key: value` lines.
+
+    The CLI's nested "person" block is lifted to the top level, empty
+    fields are dropped, nested keys are flattened ("organization.name")
+    and lists are deduplicated and ranked against the prospect's title and
+    industry. With a `token_budget` the longest lists are halved (down to
+    MIN_LIST_ITEMS) and then the lowest-priority fields dropped until the
+    estimate fits. Non-dict profiles are returned as strings unchanged.
+    """
+    if not isinstance(profile, dict):
+        return str(profile)
+
+    fields = {name: value for name, value in _flatten(_normalize(profile)) if not _is_empty(value)}
+    context = " ".join(str(fields.get(name, "")) for name in ("title", "headline", "organization.industries"))
+    for name, value in fields.items():
+        if isinstance(value, (list, tuple)):
+            fields[name] = rank_items(value, context)
+
+    order = sorted(fields, key=_priority)
+    limits = {name: len(value) for name, value in fields.items() if isinstance(value, list)}
+
+    def render():
+        lines = []
+        for name in order:
+            value = fields[name]
+            if isinstance(value, list):
+                shown = value[:limits[name]]
+                text = ", ".join(shown)
+                if len(shown) < len(value):
+                    text += f" (+{len(value) - len(shown)} more)"
+            else:
+                text = " ".join(str(value).split())
+            lines.append(f"{name}: {text}")
+        return "\n".join(lines)
+
+    text = render()
+    while token_budget and estimate_tokens(text) > token_budget:
+        longest = max(limits, key=limits.get, default=None)
+        if longest is not None and limits[longest] > MIN_LIST_ITEMS:
+            limits[longest] = max(MIN_LIST_ITEMS, limits[longest] // 2)
+        elif len(order) > 1:
+            order.pop()
+        else:
+            break
+        text = render()
+    return text
@@ -0,0 +1,98 @@
+import os
+import threading
+
+from profile_format import format_profile
+
+
+class PromptBuilder:
+    """Assemble chat messages for email generation.
+
+    The invariant part of the prompt (base instructions, company overview
+    and output format) is built once and sent first as its own system
+    message, so providers that cache prompt prefixes can reuse it across
+    prospects. The overview file is re-read only when its mtime changes.
+    Profiles are serialized with format_profile, trimmed to
+    `profile_token_budget` estimated tokens (0 = no limit).
+    """
+
+    def __init__(self, base_prompt="", overview_path=None, output_instructions="", profile_token_budget=0):
+        self.base_prompt = base_prompt or ""
+        self.overview_path = overview_path
+        self.output_instructions = output_instructions
+        self.profile_token_budget = profile_token_budget
+        self._overview_mtime = None
+        self._system_prompt = None
+        self._lock = threading.Lock()
+
+    def _current_mtime(self):
+        if not self.overview_path:
+            return None
+        try:
+            return os.stat(self.overview_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def system_prompt(self):
+        """Return the static prompt prefix, rebuilding it if the overview file changed."""
+        mtime = self._current_mtime()
+        with self._lock:
+            if self._system_prompt is None or mtime != self._overview_mtime:
+                self._system_prompt = self._build_system_prompt()
+                self._overview_mtime = mtime
+            return self._system_prompt
+
+    def _build_system_prompt(self):
+        parts = [self.base_prompt.strip()]
+        if self.overview_path and os.path.exists(self.overview_path):
+            with open(self.overview_path, "r", encoding="utf-8") as file:
+                overview = file.read().strip()
+            if overview:
+                parts.append(f"My company overview:\n{overview}")
+        if self.output_instructions:
+            parts.append(self.output_instructions)
+        return "\n\n".join(part for part in parts if part)
+
+    def _sender_and_prompt(self, user_prompt, sender):
+        parts = []
+        if sender and any(sender.values()):
+            parts.append(
+                f"Knowing my name: {sender.get('name', '')}, my position: {sender.get('position', '')}, "
+                f"my contact information: {sender.get('contact', '')}"
+            )
+        if user_prompt:
+            parts.append(user_prompt.strip())
+        return parts
+
+    def build_messages(self, profile_data, user_prompt="", sender=None):
+        """Return [system, user] messages for one prospect.
+
+        `sender` is an optional dict with name/position/contact of the person
+        the email is sent from.
+        """
+        parts = self._sender_and_prompt(user_prompt, sender)
+        parts.append(f"Here is the profile data:\n{format_profile(profile_data, self.profile_token_budget)}")
+        return [
+            {"role": "system", "content": self.system_prompt()},
+            {"role": "user", "content": "\n\n".join(parts)}
+        ]
+
+    def build_batch_messages(self, profiles, user_prompt="", sender=None):
+        """Return [system, user] messages asking for the emails of several prospects in one call.
+
+        `profiles` maps a short prospect id to its profile data. The system
+        message is the same one single-prospect calls use, so the cached
+        prefix is shared between both modes.
+        """
+        parts = self._sender_and_prompt(user_prompt, sender)
+        example = ", ".join(f'"{prospect_id}": [...]' for prospect_id in list(profiles)[:2])
+        parts.append(
+            "Write separate emails for each of the following prospects. Return a single JSON object "
+            f"that maps every prospect id to that prospect's result in the format above, like {{{example}}}. "
+            "Include each prospect id exactly once."
+        )
+        for prospect_id, profile_data in profiles.items():
+            parts.append(f"Prospect {prospect_id} profile data:\n{format_profile(profile_data, self.profile_token_budget)}")
+        return [
+            {"role": "system", "content": self.system_prompt()},
+            {"role": "user", "content": "\n\n".join(parts)}
+        ]
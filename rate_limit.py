@@ -0,0 +1,167 @@
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by sync and async callers.
+
+    `rate_per_minute` is the configured ceiling. A throttling response
+    (429) pauses the bucket for the Retry-After period and halves the
+    current rate; each success recovers it gradually back to the ceiling.
+    """
+
+    def __init__(self, rate_per_minute, burst=None, min_rate_per_minute=None):
+        self.max_rate = rate_per_minute / 60.0
+        self.min_rate = (min_rate_per_minute or max(1, rate_per_minute / 20)) / 60.0
+        self.rate = self.max_rate
+        self.capacity = burst or max(1.0, self.max_rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Take a token and return how long the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self):
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def on_throttled(self, retry_after=None):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def on_success(self):
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name, rate_per_minute):
+    """Return the process-wide limiter for an upstream, creating it on first use."""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = TokenBucket(rate_per_minute)
+        return _limiters[name]
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (seconds or HTTP date) into seconds, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_transient_error(exc):
+    if isinstance(exc, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    # requests, httpx and litellm each define their own timeout/connection errors
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    return any("Timeout" in name or name in ("ConnectError", "ConnectionError", "RemoteProtocolError") for name in names)
+
+
+def classify(result=None, exc=None):
+    """Return (retryable, retry_after seconds, throttled) for a response or exception."""
+    if exc is not None:
+        status = getattr(exc, "status_code", None)
+        if status in RETRYABLE_STATUS_CODES:
+            response = getattr(exc, "response", None)
+            headers = getattr(response, "headers", None) or {}
+            return True, parse_retry_after(headers.get("retry-after")), status == 429
+        return _is_transient_error(exc), None, False
+    status = getattr(result, "status_code", None)
+    if status in RETRYABLE_STATUS_CODES:
+        return True, parse_retry_after(result.headers.get("retry-after")), status == 429
+    return False, None, False
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def call_with_retries(fn, limiter=None, max_retries=3, on_retry=None):
+    """Call `fn()` through `limiter`, retrying 429s, transient 5xx and timeouts.
+
+    `fn` returns a response object (requests/httpx) or raises. After the
+    last attempt the final response is returned or the exception re-raised.
+    """
+    attempt = 0
+    while True:
+        if limiter:
+            limiter.acquire()
+        try:
+            result, exc = fn(), None
+        except Exception as e:
+            result, exc = None, e
+        retryable, retry_after, throttled = classify(result, exc)
+        if limiter and throttled:
+            limiter.on_throttled(retry_after)
+        elif limiter and not retryable:
+            limiter.on_success()
+        if not retryable or attempt >= max_retries:
+            if exc is not None:
+                raise exc
+            return result
+        if on_retry:
+            on_retry(attempt, result, exc)
+        time.sleep(retry_after if retry_after is not None else backoff_delay(attempt))
+        attempt += 1
+
+
+async def acall_with_retries(fn, limiter=None, max_retries=3, on_retry=None):
+    """Async version of call_with_retries; `fn()` returns an awaitable."""
+    attempt = 0
+    while True:
+        if limiter:
+            await limiter.acquire_async()
+        try:
+            result, exc = await fn(), None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result, exc = None, e
+        retryable, retry_after, throttled = classify(result, exc)
+        if limiter and throttled:
+            limiter.on_throttled(retry_after)
+        elif limiter and not retryable:
+            limiter.on_success()
+        if not retryable or attempt >= max_retries:
+            if exc is not None:
+                raise exc
+            return result
+        if on_retry:
+            on_retry(attempt, result, exc)
+        await asyncio.sleep(retry_after if retry_after is not None else backoff_delay(attempt))
+        attempt += 1
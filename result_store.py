@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+import uuid
+
+from cache import connect_sqlite
+
+
+class ResultStore:
+    """SQLite-backed store of search and CSV run results, keyed by run id.
+
+    Results are appended as they are produced, so exports and paging read
+    them back from disk instead of the client re-uploading them. Runs
+    older than `ttl` seconds are evicted, and beyond `max_runs` the least
+    recently updated ones go first; eviction runs whenever a run is created.
+    """
+
+    def __init__(self, path, ttl=24 * 3600, max_runs=200):
+        self.path = path
+        self.ttl = ttl
+        self.max_runs = max_runs
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = connect_sqlite(self.path)
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                " id TEXT PRIMARY KEY, owner TEXT, kind TEXT NOT NULL, status TEXT NOT NULL,"
+                " columns TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS run_results ("
+                " run_id TEXT NOT NULL, position INTEGER NOT NULL, data TEXT NOT NULL,"
+                " PRIMARY KEY (run_id, position));"
+                "CREATE INDEX IF NOT EXISTS runs_updated ON runs (updated_at);"
+            )
+        return self._conn
+
+    def create_run(self, kind, owner=None, columns=None):
+        """Start a new run and return its id, evicting expired runs first."""
+        run_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            self._evict(conn, now)
+            conn.execute(
+                "INSERT INTO runs (id, owner, kind, status, columns, created_at, updated_at) VALUES (?, ?, ?, 'running', ?, ?, ?)",
+                (run_id, owner, kind, json.dumps(columns) if columns is not None else None, now, now)
+            )
+        return run_id
+
+    def _evict(self, conn, now):
+        expired = [row[0] for row in conn.execute("SELECT id FROM runs WHERE updated_at < ?", (now - self.ttl,))] if self.ttl else []
+        if self.max_runs:
+            expired += [row[0] for row in conn.execute(
+                "SELECT id FROM runs WHERE updated_at >= ? ORDER BY updated_at DESC LIMIT -1 OFFSET ?",
+                (now - self.ttl if self.ttl else 0, self.max_runs - 1)
+            )]
+        if expired:
+            placeholders = ",".join("?" * len(expired))
+            conn.execute("BEGIN")
+            conn.execute(f"DELETE FROM run_results WHERE run_id IN ({placeholders})", expired)
+            conn.execute(f"DELETE FROM runs WHERE id IN ({placeholders})", expired)
+            conn.execute("COMMIT")
+
+    def add_result(self, run_id, position, data):
+        """Store one result at `position` (its order in exports and pages)."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO run_results (run_id, position, data) VALUES (?, ?, ?)",
+                (run_id, position, json.dumps(data))
+            )
+            conn.execute("UPDATE runs SET updated_at = ? WHERE id = ?", (time.time(), run_id))
+
+    def finish_run(self, run_id, status="completed"):
+        with self._lock:
+            self._connect().execute(
+                "UPDATE runs SET status = ?, updated_at = ? WHERE id = ?",
+                (status, time.time(), run_id)
+            )
+
+    def get_run(self, run_id):
+        """Return the run record with its result count, or None."""
+        with self._lock:
+            conn = self._connect()
+            run = conn.execute(
+                "SELECT id, owner, kind, status, columns, created_at, updated_at FROM runs WHERE id = ?", (run_id,)
+            ).fetchone()
+            if run is None:
+                return None
+            count = conn.execute("SELECT COUNT(*) FROM run_results WHERE run_id = ?", (run_id,)).fetchone()[0]
+        return {
+            "id": run[0],
+            "owner": run[1],
+            "kind": run[2],
+            "status": run[3],
+            "columns": json.loads(run[4]) if run[4] else None,
+            "created_at": run[5],
+            "updated_at": run[6],
+            "total_results": count
+        }
+
+    def iter_results(self, run_id, offset=0, limit=None, chunk_size=500):
+        """Yield stored results in position order, reading `chunk_size` rows per query."""
+        remaining = limit
+        last_position = None
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            with self._lock:
+                conn = self._connect()
+                if last_position is None:
+                    rows = conn.execute(
+                        "SELECT position, data FROM run_results WHERE run_id = ? ORDER BY position LIMIT ? OFFSET ?",
+                        (run_id, size, offset)
+                    ).fetchall()
+                else:
+                    # Continue after the last row read instead of re-scanning with OFFSET
+                    rows = conn.execute(
+                        "SELECT position, data FROM run_results WHERE run_id = ? AND position > ? ORDER BY position LIMIT ?",
+                        (run_id, last_position, size)
+                    ).fetchall()
+            for _, data in rows:
+                yield json.loads(data)
+            if len(rows) < size:
+                return
+            last_position = rows[-1][0]
+            if remaining is not None:
+                remaining -= len(rows)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
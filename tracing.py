@@ -0,0 +1,206 @@
+import contextvars
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+SERVICE_NAME = "cold-email-generator"
+
+# Innermost open span of the current request; asyncio tasks inherit it when created
+_current_span = contextvars.ContextVar("current_span", default=None)
+_export_lock = threading.Lock()
+
+
+def _attribute(key, value):
+    """Encode one attribute in the OTLP/JSON key-value form."""
+    if isinstance(value, bool):
+        encoded = {"boolValue": value}
+    elif isinstance(value, int):
+        encoded = {"intValue": str(value)}
+    elif isinstance(value, float):
+        encoded = {"doubleValue": value}
+    else:
+        encoded = {"stringValue": str(value)}
+    return {"key": key, "value": encoded}
+
+
+class Span:
+    def __init__(self, trace, name, parent_id="", attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set(self, **attributes):
+        """Add attributes (timings, payload sizes, ids) to the span."""
+        self.attributes.update(attributes)
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.trace.add(self)
+
+    def to_otlp(self):
+        return {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [_attribute(key, value) for key, value in self.attributes.items() if value is not None],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1}
+        }
+
+
+class _NoopSpan:
+    """Returned by span() when the request is not traced, so call sites need no checks."""
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """Spans of one traced run, exported together when the run ends."""
+
+    def __init__(self, name, path, trace_id=None):
+        self.name = name
+        self.path = path
+        self.trace_id = trace_id or new_trace_id()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def export(self):
+        """Append the trace to `path` as one OTLP/JSON ExportTraceServiceRequest line."""
+        with self._lock:
+            spans = [span.to_otlp() for span in self.spans]
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}]
+            }]
+        }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        line = json.dumps(payload, ensure_ascii=False) + "\n"
+        with _export_lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def new_trace_id():
+    return secrets.token_hex(16)
+
+
+@contextmanager
+def _activate(span):
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"[:500]
+        raise
+    finally:
+        span.end()
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # A streaming generator may be finished from another context
+            _current_span.set(None)
+
+
+@contextmanager
+def start_trace(name, path, trace_id=None, profiler=None, **attributes):
+    """Trace a run: open its root span, yield it, and export all spans on exit.
+
+    Spans opened with span() while the root is active (also in tasks
+    created meanwhile) become its descendants. With a `profiler` it runs
+    for the duration of the trace and its output path is recorded on the root.
+    """
+    trace = Trace(name, path, trace_id)
+    root = Span(trace, name, attributes=attributes)
+    if profiler is not None:
+        profiler.start()
+    try:
+        with _activate(root):
+            yield root
+    finally:
+        if profiler is not None:
+            root.set(**{"profile.path": profiler.stop(trace.trace_id)})
+        trace.export()
+
+
+@contextmanager
+def span(name, **attributes):
+    """Open a child of the current span; a no-op when no trace is active."""
+    parent = _current_span.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+    with _activate(Span(parent.trace, name, parent.span_id, attributes)) as child:
+        yield child
+
+
+def current_span():
+    """The innermost open span, or a no-op span outside a trace."""
+    return _current_span.get() or NOOP_SPAN
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack every `interval` seconds from a helper thread.
+
+    Stacks are written in the collapsed ("folded") format understood by
+    flamegraph.pl and speedscope. Everything running on the sampled thread
+    is included, so concurrent requests on the same event loop show up too.
+    """
+
+    def __init__(self, directory, interval=0.005, thread_id=None):
+        self.directory = directory
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self, name):
+        """Stop sampling and write `<directory>/<name>.folded`; returns its path."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{name}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path